@@ -1,40 +1,49 @@
 import os
 import csv
+import argparse
+
+from tja_index import tja_index, load_tja_index, courses_with_level
 
 CUSTOMSONG_DIR = os.path.join("D:\\", "games", "TaikoTDM",
                               "CustomSongSources", "ESE")
+EXCLUDED_DIRS = ['Taiko Towers', 'Dan Dojo']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write the titles of every TJA with a 10-star course "
+                    "to output.csv.")
+    parser.add_argument("root_dirs", nargs="*", default=[CUSTOMSONG_DIR],
+                        help="Folders to search for TJAs (default: "
+                             f"{CUSTOMSONG_DIR})")
+    parser.add_argument("--cached", action="store_true",
+                        help="Query the TJA index as-is, without checking "
+                             "the folders for new/changed TJAs")
+    return parser.parse_args()
+
 
-names = []
-for root, dirs, files in os.walk(CUSTOMSONG_DIR, topdown=True):
-    for file in files:
-        if any(substring in root for substring in ['Taiko Towers',
-                                                   'Dan Dojo']):
+def main():
+    args = parse_args()
+    if args.cached:
+        tjas = load_tja_index()
+    else:
+        tjas = tja_index(args.root_dirs)
+
+    names = {}
+    for tja_path, header, course in courses_with_level(tjas, 10,
+                                                       args.root_dirs):
+        if any(substring in os.path.dirname(tja_path)
+               for substring in EXCLUDED_DIRS):
             continue
-        if file.endswith(".tja"):
-            with open(os.path.join(root, file), encoding="utf8") as tja:
-                try:
-                    lines = tja.readlines()
-                except Exception:
-                    print(f"`tja.readlines()` failed for {file}.")
-                    continue
-                title, titleja = '', ''
-                for line in lines:
-                    if line.startswith("TITLE:"):
-                        title = line.split(':')[1].rstrip()
-                    elif line.startswith("TITLEJA:"):
-                        titleja = line.split(':')[1].rstrip()
-                    if title and titleja:
-                        break
-                for line in lines:
-                    if line.startswith("LEVEL:"):
-                        stars = int(line.split(':')[1].rstrip())
-                        if stars == 10:
-                            print(f"Title: {title}")
-                            names.append([title])
-                            break
-
-names = sorted(names)
-
-with open("output.csv", "w", encoding="utf8", newline="\n") as f:
-    writer = csv.writer(f)
-    writer.writerows(names)
+        if tja_path not in names:
+            print(f"Title: {header['title']} ({course['course']})")
+            names[tja_path] = [header['title']]
+    names = sorted(names.values())
+
+    with open("output.csv", "w", encoding="utf8", newline="\n") as f:
+        writer = csv.writer(f)
+        writer.writerows(names)
+
+
+if __name__ == "__main__":
+    main()
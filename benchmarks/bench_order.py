@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark `update_order` against the per-song key functions it replaced.
+
+Builds a synthetic library (100k songs by default), checks that every
+ordering mode produces the same order as the old `sorted(key=...)` code, and
+times both.
+"""
+
+# stdlib
+import argparse
+import random
+import sys
+
+# personal utility libraries
+from bench_utils import time_it
+from song_order import ORDER_MODES, build_sort_keys, strip_accents
+
+TITLE_CHARS = "abcdeéèfghiíjklmnoóöpqrstuúüvwxyzアイウエオ "
+DEBUTS = ["Arcade", "NS1", "NS2", "PS Vita", "Nijiiro", "Blue", "Green"]
+
+
+def synthetic_library(n_songs, seed=0):
+    rng = random.Random(seed)
+    jsons, entries = {}, {}
+    for i in range(n_songs):
+        song_id = f"song{i:06d}"
+        star_mania = rng.randint(1, 10)
+        star_ura = rng.choice([0, 0, rng.randint(1, 10)])
+        jsons[song_id] = {
+            'id': song_id,
+            'genreNo': rng.randint(0, 7),
+            'starMax': max(star_mania, star_ura),
+            'starMania': star_mania,
+            'starUra': star_ura,
+            'songName': {'text': "".join(rng.choice(TITLE_CHARS)
+                                         for _ in range(rng.randint(3, 20)))},
+            'date': f"{rng.randint(2004, 2024)}-{rng.randint(1, 12):02d}-"
+                    f"{rng.randint(1, 28):02d}",
+            'debut': rng.choice(DEBUTS),
+        }
+        for suffix in ["", "_ura"]:
+            if rng.random() < 0.3:
+                entries[song_id + suffix] = {
+                    'Score': rng.choice(["", rng.randint(0, 1_000_000)])}
+    return jsons, entries
+
+
+# The key functions that `update_order` used before `song_order` existed
+def legacy_genre_star_key(item, entries):
+    return [
+        item['genreNo'],
+        (10 - item['starMax']),
+        strip_accents(item['songName']['text']).upper()
+    ]
+
+
+def legacy_score_key(item, entries):
+    song_id = item['id']
+    song_id_ura = song_id + "_ura"
+    score_omote = (0 if (song_id not in entries
+                         or not entries[song_id]['Score'])
+                   else entries[song_id]['Score'])
+    score_ura = (0 if (song_id_ura not in entries
+                       or not entries[song_id_ura]['Score'])
+                 else entries[song_id_ura]['Score'])
+    if score_omote and not score_ura:
+        score_sort = score_omote
+        star_sort = item['starMania']
+    elif score_ura:
+        score_sort = score_ura
+        star_sort = item['starUra']
+    else:
+        score_sort = 0
+        star_sort = max(item['starMania'], item['starUra'])
+
+    if any([score_ura, score_omote]):
+        return ["1", item['genreNo'], (10 - int(star_sort)),
+                (1_000_000 - int(score_sort)), item['songName']['text']]
+    return ["2", item['genreNo'],
+            (99999999 - int(item['date'].replace('-', ''))),
+            item['debut'], strip_accents(item['songName']['text']).upper()]
+
+
+def legacy_date_key(item, entries):
+    return [
+        (99999999 - int(item['date'].replace('-', ''))),
+        item['debut'],
+        strip_accents(item['songName']['text']).upper()
+    ]
+
+
+LEGACY_KEYS = {
+    'score': legacy_score_key,
+    'genre-star': legacy_genre_star_key,
+    'date': legacy_date_key,
+}
+
+
+def legacy_order(jsons, entries, mode):
+    key_func = LEGACY_KEYS[mode]
+    return [j['id'] for j in sorted(jsons.values(),
+                                    key=lambda j: key_func(j, entries))]
+
+
+def engine_order(jsons, entries, mode, title_cache):
+    keys = build_sort_keys(jsons, entries, title_cache)
+    song_ids = list(jsons.keys())
+    return [song_ids[idx] for idx in ORDER_MODES[mode](keys)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    jsons, entries = synthetic_library(args.songs)
+    print(f"Synthetic library: {len(jsons)} songs, {len(entries)} scores")
+    failed = False
+    for mode in ORDER_MODES:
+        legacy_time, legacy = time_it(legacy_order, jsons, entries, mode,
+                                      repeat=args.repeat)
+        cold_time, cold = time_it(lambda: engine_order(jsons, entries, mode,
+                                                       {}),
+                                  repeat=args.repeat)
+        title_cache = {}
+        engine_order(jsons, entries, mode, title_cache)
+        warm_time, _ = time_it(engine_order, jsons, entries, mode,
+                               title_cache, repeat=args.repeat)
+        same = legacy == cold
+        failed |= not same
+        print(f"- {mode:>10}: legacy {legacy_time:7.3f} s | engine "
+              f"{cold_time:7.3f} s (cold) {warm_time:7.3f} s (warm) | "
+              f"{'same order' if same else 'ORDER MISMATCH'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark loading every data.json in a library (`utils.load_data_jsons`).
+
+Builds a synthetic library (5k songs by default) whose data.json files are
+BOM-prefixed, like the ones `data.json_manager` writes, and compares the
+old loader (one file at a time, each one parsed as `utf-8` first and then
+again as `utf-8-sig`) with the current one, after a warm-up scan so that
+only the file reads get timed.
+"""
+
+# stdlib
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+# personal utility libraries
+from bench_utils import time_it
+import utils
+from scan_manifest import scan_library, iter_dirs
+from synthetic_library import build_library
+
+
+# What `read_json` did before it read each file's bytes only once
+def legacy_read_json(json_filepath):
+    for e_str in ["utf-8", "utf-8-sig"]:
+        try:
+            with open(json_filepath, encoding=e_str) as fp:
+                return json.load(fp)
+        except json.decoder.JSONDecodeError:
+            pass
+
+
+def legacy_load_data_jsons(root_dir):
+    jsons = {}
+    for root, entry in iter_dirs(scan_library(root_dir)):
+        if entry['datajson'] is None or entry['datajson']['id'] is None:
+            continue
+        json_dict = legacy_read_json(os.path.join(root, "data.json"))
+        jsons[json_dict['id']] = json_dict
+    return {k: jsons[k] for k in sorted(jsons.keys())}
+
+
+def add_boms(root_dir):
+    for dir_path, _, filenames in os.walk(root_dir):
+        if "data.json" in filenames:
+            json_path = os.path.join(dir_path, "data.json")
+            with open(json_path, "rb") as fp:
+                bytestring = fp.read()
+            with open(json_path, "wb") as fp:
+                fp.write(b"\xef\xbb\xbf" + bytestring)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--songs", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_dir = os.path.join(tmp_dir, "customSongs")
+        build_library(root_dir, args.songs)
+        add_boms(root_dir)
+        scan_library(root_dir)
+        print(f"Synthetic library: {args.songs} songs "
+              f"(orjson: {'yes' if utils.orjson is not None else 'no'})")
+
+        legacy_time, legacy = time_it(legacy_load_data_jsons, root_dir,
+                                      repeat=args.repeat)
+        new_time, new = time_it(utils.load_data_jsons, root_dir,
+                                repeat=args.repeat)
+
+    same = legacy == new
+    print(f"- legacy {legacy_time:7.3f} s | current {new_time:7.3f} s "
+          f"({legacy_time / new_time:.1f}x) | "
+          f"{'same jsons' if same else 'JSON MISMATCH'}")
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
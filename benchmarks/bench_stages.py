@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark each stage of `data.json_manager` on synthetic libraries.
+
+For each size (1k/10k/50k songs by default), builds a customSongs folder
+in a temp dir (see `synthetic_library.py`), seeds an in-memory metadata
+sheet with most of its songs (so that the rest have to be imported),
+writes a save.json, and then runs a full sync against it, using
+`fake_pygsheets` and `fake_tjaconvert.py` in place of Google Sheets and
+TJAConvert.exe. Each sync runs in its own process with its own (temp) cache
+dir, and its `--report` gets summarised as a table of stage timings. Memory
+is reported as peak RSS, unless `--report-memory` turns on tracemalloc
+(which slows every stage down, so don't compare timings across the two).
+"""
+
+# stdlib
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# personal utility libraries
+from bench_utils import BENCH_DIR, load_manager
+
+FAKE_TJACONVERT = os.path.join(BENCH_DIR, "fake_tjaconvert.py")
+
+
+def parse_sizes(arg):
+    return [int(size) for size in arg.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--sizes", type=parse_sizes,
+                        default=[1_000, 10_000, 50_000],
+                        help="Comma-separated library sizes "
+                             "(default: 1000,10000,50000)")
+    parser.add_argument("--tjas", type=int,
+                        default=0 if os.name == 'nt' else 20,
+                        help="# of TJA folders to convert in each library "
+                             "(default: 20, or 0 on Windows, where the "
+                             "fake TJAConvert can't be run directly)")
+    parser.add_argument("--new-ratio", type=float, default=0.1,
+                        help="Fraction of songs missing from the sheet, "
+                             "i.e. that get imported (default: 0.1)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--report-memory", action="store_true",
+                        help="Trace each stage's peak memory with "
+                             "tracemalloc, instead of reporting peak RSS")
+    parser.add_argument("--report-dir",
+                        help="Keep each size's JSON report in this folder")
+    # Used by the parent process to run a single size
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--report", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_sync(args):
+    # Runs in a child process, with TDMX_CACHE_DIR/TJACONVERT already set
+    import fake_pygsheets
+    sys.modules['pygsheets'] = fake_pygsheets
+    import utils as tdmx_utils
+    from synthetic_library import (build_library, metadata_rows,
+                                   write_save_json)
+
+    manager = load_manager()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_dir = os.path.join(tmp_dir, "customSongs")
+        start = time.perf_counter()
+        metadata = build_library(root_dir, args.child, n_tjas=args.tjas)
+        n_sheet = round(len(metadata) * (1 - args.new_ratio))
+        sheet = fake_pygsheets.FakeClient().open(manager.SHEET_NAME)
+        # In the same (newest first) order the manager writes the sheet in,
+        # as if an earlier sync had written it
+        seeded = sorted(list(metadata.items())[:n_sheet],
+                        key=lambda item: item[1]['date'], reverse=True)
+        sheet.sheet1.rows = metadata_rows(dict(seeded), manager.CSV_HEADERS)
+        save_path = os.path.join(tmp_dir, "TakoTako", "saves", "save.json")
+        write_save_json(save_path, {song_id: tdmx_utils.songid_to_uid(song_id)
+                                    for song_id in metadata})
+        print(f"Built {len(metadata)} songs + {args.tjas} TJAs in "
+              f"{time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+        manager.CUSTOMSONG_DIR = root_dir
+        tdmx_utils.__takotako_save__ = save_path
+        # metadata.csv gets written to the cwd
+        old_cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            manager.main(["--report", args.report, "--jobs", str(args.jobs)]
+                         + (["--report-memory"] if args.report_memory
+                            else []))
+        finally:
+            os.chdir(old_cwd)
+
+
+def run_size(args, size, report_path):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        report_path = os.path.abspath(report_path)
+        env = dict(os.environ, TDMX_CACHE_DIR=cache_dir,
+                   TJACONVERT=FAKE_TJACONVERT)
+        command = [sys.executable, os.path.abspath(__file__),
+                   "--child", str(size), "--report", report_path,
+                   "--tjas", str(args.tjas), "--new-ratio",
+                   str(args.new_ratio), "--jobs", str(args.jobs)]
+        if args.report_memory:
+            command.append("--report-memory")
+        # The sync's own output would drown out the results
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL,
+                       check=True)
+    with open(report_path, encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def format_bytes(n_bytes):
+    if n_bytes is None:
+        return "-"
+    for unit in ["B", "KB", "MB"]:
+        if n_bytes < 1024:
+            return f"{n_bytes:.0f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} GB"
+
+
+def print_report(size, report):
+    trace_memory = report['trace_memory']
+    memory_key = 'peak_memory' if trace_memory else 'max_rss'
+    print(f"\n{size} songs: {report['seconds']:.2f} s total"
+          + (" (with tracemalloc)" if trace_memory else ""))
+    print(f"  {'stage':<16} {'calls':>5} {'seconds':>9} {'items':>7} "
+          f"{'read':>9} {'written':>9} "
+          f"{'peak mem' if trace_memory else 'peak RSS':>9}")
+    for record in report['stages']:
+        print(f"  {record['name']:<16} {record['calls']:>5} "
+              f"{record['seconds']:>9.3f} {record['items']:>7} "
+              f"{format_bytes(record['bytes_read']):>9} "
+              f"{format_bytes(record['bytes_written']):>9} "
+              f"{format_bytes(record[memory_key]):>9}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child is not None:
+        run_sync(args)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_dir = args.report_dir or tmp_dir
+        os.makedirs(report_dir, exist_ok=True)
+        for size in args.sizes:
+            report_path = os.path.join(report_dir, f"stages_{size}.json")
+            print_report(size, run_size(args, size, report_path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark how long it takes to import `data.json_manager`.
+
+Each sample imports the module in a fresh interpreter. The benchmark fails
+if the import takes longer than `--max-seconds`, or if it pulls in any of
+the heavy libraries that should only be imported on demand.
+"""
+
+# stdlib
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# personal utility libraries
+from bench_utils import BENCH_DIR
+
+HEAVY_MODULES = ["pandas", "pygsheets", "tja2fumen", "numpy"]
+
+SNIPPET = f"""
+import json, sys, time
+sys.path.insert(0, {BENCH_DIR!r})
+start = time.perf_counter()
+from bench_utils import load_manager
+load_manager()
+elapsed = time.perf_counter() - start
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy_modules": heavy}}))
+"""
+
+
+def sample_import():
+    output = subprocess.check_output([sys.executable, "-c", SNIPPET])
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    samples = [sample_import() for _ in range(args.repeat)]
+    median = statistics.median(s['seconds'] for s in samples)
+    heavy = sorted({m for s in samples for m in s['heavy_modules']})
+    print(f"Import time (median of {args.repeat}): {median * 1000:.1f} ms")
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {heavy}")
+        return 1
+    if median > args.max_seconds:
+        print(f"FAIL: import took longer than {args.max_seconds} s")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
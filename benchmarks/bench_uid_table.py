@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark remapping TakoTako's save.json scores from UIDs to song IDs.
+
+Builds a synthetic library (100k song IDs by default) and a save.json with
+scores for most of them (plus scores for songs that aren't in the library),
+checks that `uid_index`/`remap_scores` give the same result as the original
+remapping loop, and times both, plus a remap that loads the UIDs from an
+on-disk table instead of hashing them. (That table used to be kept in
+cache/uid_table.json, but loading it was never faster than re-hashing.)
+"""
+
+# stdlib
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+# personal utility libraries
+from bench_utils import time_it
+from utils import read_json, songid_to_uid, load_json_cache
+from uid_table import uid_index, remap_scores
+
+
+def synthetic_song_ids(n_songs, seed=0):
+    rng = random.Random(seed)
+    # Mostly string IDs (which need hashing), plus some numeric ones
+    return [str(i) if rng.random() < 0.3 else f"song{i:06d}"
+            for i in range(n_songs)]
+
+
+def synthetic_save_json(song_ids, n_unknown, seed=0):
+    rng = random.Random(seed)
+    save = {}
+    for score_key in ['m', 'r']:
+        scores = {}
+        for song_id in song_ids:
+            if rng.random() < 0.8:
+                scores[songid_to_uid(song_id)] = {
+                    'score': rng.randint(0, 1_000_000),
+                    'crown': rng.randint(0, 3)}
+        for i in range(n_unknown):
+            scores[str(rng.randint(0, 0xFFFF_FFF))] = {'score': 0, 'crown': 0}
+        save[score_key] = scores
+    return save
+
+
+# What `load_takotako_save_json_with_songids` did before the UID table
+def legacy_remap(save_path, song_ids):
+    takotako_scores = read_json(save_path)
+    ids = {songid_to_uid(song_id): song_id for song_id in song_ids}
+    for score_key, score_dict in takotako_scores.items():
+        new_score_dict = {}
+        for unique_id, song_dict in score_dict.items():
+            if unique_id in ids.keys():
+                new_score_dict[ids[unique_id]] = song_dict
+        takotako_scores[score_key] = new_score_dict
+    return takotako_scores['m'], takotako_scores['r']
+
+
+def index_remap(save_path, song_ids):
+    takotako_scores = read_json(save_path)
+    index = uid_index(song_ids)
+    takotako_scores = {score_key: remap_scores(score_dict, index)
+                       for score_key, score_dict in takotako_scores.items()}
+    return takotako_scores['m'], takotako_scores['r']
+
+
+# What the remap did with a (warm) on-disk UID table
+def table_remap(save_path, song_ids, table_path):
+    takotako_scores = read_json(save_path)
+    uids = load_json_cache(table_path)
+    index = {uids[song_id]: song_id for song_id in song_ids}
+    takotako_scores = {score_key: remap_scores(score_dict, index)
+                       for score_key, score_dict in takotako_scores.items()}
+    return takotako_scores['m'], takotako_scores['r']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--unknown-scores", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    song_ids = synthetic_song_ids(args.songs)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_path = os.path.join(tmp_dir, "save.json")
+        with open(save_path, "w", encoding="utf-8") as fp:
+            json.dump(synthetic_save_json(song_ids, args.unknown_scores), fp)
+        table_path = os.path.join(tmp_dir, "uid_table.json")
+        print(f"Synthetic library: {len(song_ids)} songs, save.json "
+              f"{os.path.getsize(save_path) / 1e6:.1f} MB")
+
+        with open(table_path, "w", encoding="utf-8") as fp:
+            json.dump({song_id: songid_to_uid(song_id)
+                       for song_id in song_ids}, fp)
+
+        legacy_time, legacy = time_it(legacy_remap, save_path, song_ids,
+                                      repeat=args.repeat)
+        index_time, index = time_it(index_remap, save_path, song_ids,
+                                    repeat=args.repeat)
+        table_time, table = time_it(table_remap, save_path, song_ids,
+                                    table_path, repeat=args.repeat)
+
+    same = legacy == index == table
+    print(f"- legacy {legacy_time:7.3f} s | index {index_time:7.3f} s | "
+          f"table {table_time:7.3f} s (warm) | "
+          f"{'same scores' if same else 'SCORE MISMATCH'}")
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""
+Helpers shared by the benchmark scripts in this folder.
+"""
+
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+MANAGER_PATH = os.path.join(REPO_DIR, "data.json_manager.py")
+
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+
+def load_manager():
+    # `data.json_manager` can't be imported normally because of the `.` in
+    # its filename, so load it straight from its path instead
+    spec = importlib.util.spec_from_file_location("data_json_manager",
+                                                  MANAGER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_it(func, *args, repeat=5, **kwargs):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
@@ -0,0 +1,117 @@
+"""
+In-memory stand-in for the parts of `pygsheets` that these scripts use.
+
+Install it in place of the real library before the scripts import it:
+
+    import sys
+    import fake_pygsheets
+    sys.modules['pygsheets'] = fake_pygsheets
+
+Every spreadsheet lives in `SPREADSHEETS` (keyed by name), and each
+worksheet counts the API requests and cells it would have sent to Google.
+"""
+
+import re
+
+SPREADSHEETS = {}
+
+A1_RE = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+def parse_a1(cell):
+    match = A1_RE.match(cell)
+    letters, row = match.group(1), int(match.group(2))
+    col = 0
+    for letter in letters:
+        col = col * 26 + (ord(letter) - ord('A') + 1)
+    return row - 1, col - 1
+
+
+class FakeWorksheet:
+    def __init__(self, rows=None):
+        self.rows = [list(row) for row in rows or []]
+        self.n_requests = 0
+        self.n_cells_written = 0
+
+    def _write_cell(self, row, col, value):
+        while len(self.rows) <= row:
+            self.rows.append([])
+        while len(self.rows[row]) <= col:
+            self.rows[row].append("")
+        self.rows[row][col] = value
+        self.n_cells_written += 1
+
+    def _write_block(self, start_row, start_col, values):
+        for i, row_values in enumerate(values):
+            for j, value in enumerate(row_values):
+                self._write_cell(start_row + i, start_col + j, value)
+
+    def get_all_values(self):
+        self.n_requests += 1
+        return [list(row) for row in self.rows]
+
+    def get_as_df(self):
+        import pandas
+        self.n_requests += 1
+        header, *rows = self.rows
+        return pandas.DataFrame(rows, columns=header)
+
+    def set_dataframe(self, df, start, copy_head=True):
+        self.n_requests += 1
+        values = df.values.tolist()
+        if copy_head:
+            values = [df.columns.tolist()] + values
+        self.rows = []
+        self._write_block(start[0] - 1, start[1] - 1, values)
+
+    def update_values(self, crange, values):
+        self.n_requests += 1
+        self._write_block(*parse_a1(crange.split(":")[0]), values)
+
+    def update_values_batch(self, ranges, values, majordim='ROWS'):
+        assert majordim == 'ROWS'
+        self.n_requests += 1
+        for crange, block in zip(ranges, values):
+            self._write_block(*parse_a1(crange.split(":")[0]), block)
+
+    def insert_rows(self, row, number=1, values=None, inherit=False):
+        # Inserts after (1-indexed) `row`. pygsheets sends the values as a
+        # second request.
+        self.n_requests += 1
+        while len(self.rows) < row:
+            self.rows.append([])
+        self.rows[row:row] = [[] for _ in range(number)]
+        if values is not None:
+            self.n_requests += 1
+            self._write_block(row, 0, values)
+
+    def delete_rows(self, index, number=1):
+        self.n_requests += 1
+        del self.rows[index - 1:index - 1 + number]
+
+    def clear(self):
+        self.n_requests += 1
+        self.rows = []
+
+
+class FakeSpreadsheet:
+    def __init__(self, n_worksheets=1):
+        self.worksheets = [FakeWorksheet() for _ in range(n_worksheets)]
+
+    @property
+    def sheet1(self):
+        return self.worksheets[0]
+
+    def __getitem__(self, idx):
+        return self.worksheets[idx]
+
+
+class FakeClient:
+    def open(self, name):
+        if name not in SPREADSHEETS:
+            SPREADSHEETS[name] = FakeSpreadsheet()
+        return SPREADSHEETS[name]
+
+
+def authorize(*args, **kwargs):
+    return FakeClient()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""
+Stand-in for TJAConvert.exe, for benchmarking without Windows/TakoTako.
+
+Usage: fake_tjaconvert.py <TJA folder>
+
+Like the real thing, it writes a `[GENERATED] <folder name>` folder (with a
+data.json, song_[id].bin and gzipped fumens for each course in the TJA)
+next to the TJA, and reports "<exit code>:<message>" on its last line of
+output. Point `tjaconvert.main` at it with the TJACONVERT env var.
+"""
+
+# stdlib
+import hashlib
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# benchmark helpers
+from synthetic_library import (datajson_dict, parse_tja_header,  # noqa: E402
+                               tja_song_id, write_song)
+
+
+def main(root_dir):
+    tja_names = [f for f in os.listdir(root_dir) if f.endswith(".tja")]
+    if not tja_names:
+        return 1, f"No .tja file in {root_dir}"
+    tja_path = os.path.abspath(os.path.join(root_dir, tja_names[0]))
+    title, stars = parse_tja_header(tja_path)
+    with open(tja_path, "rb") as fp:
+        tja_hash = hashlib.md5(fp.read()).hexdigest()
+    song_id = tja_song_id(tja_path)
+    rng = random.Random(song_id)
+    json_dict = datajson_dict(song_id, rng, title=title, stars=stars,
+                              gzipped=True, tja_hash=tja_hash)
+    gen_dir = os.path.join(root_dir,
+                           f"[GENERATED] {os.path.basename(root_dir)}")
+    write_song(gen_dir, json_dict, rng)
+    return 0, f"Converted {tja_names[0]}"
+
+
+if __name__ == '__main__':
+    errno, message = main(sys.argv[1])
+    # TJAConvert.exe uses Windows line endings, which `convert_tja` expects
+    sys.stdout.write(f"{errno}:{message}\r\n")
+    sys.exit(errno)
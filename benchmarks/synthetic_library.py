@@ -0,0 +1,270 @@
+"""
+Generator for synthetic customSongs folders, for benchmarking
+`data.json_manager` without a real TaikoTDM install.
+
+Each song gets a folder with a TakoTako-style `data.json`, a
+`song_[id].bin` (an `@UTF` header, with the volume float at `0x217`) and
+one fumen per course, laid out like tja2fumen writes them (a 520-byte
+header, then "ffBBHiiiiiii" measures, "HHf" branches and "ififHHf" notes).
+Some songs' fumens are gzipped, like freshly-converted songs' are. TJA
+folders (a `.tja` plus its audio, for `fake_tjaconvert.py` to convert)
+can be added too, as can a TakoTako `save.json` with scores.
+
+Only the standard library is needed, since `fake_tjaconvert.py` runs this
+module in its own (bare) interpreter.
+"""
+
+# stdlib
+import gzip
+import hashlib
+import json
+import os
+import random
+import struct
+
+GENRE_DIRS = ["01 Pop", "02 Anime", "03 Vocaloid", "04 Variety",
+              "05 Children and Folk", "06 Classical", "07 Game Music",
+              "08 Namco Original"]
+COURSES = [("Easy", "e"), ("Normal", "n"), ("Hard", "h"), ("Mania", "m"),
+           ("Ura", "x")]
+TJA_COURSES = {"Easy": "Easy", "Normal": "Normal", "Hard": "Hard",
+               "Mania": "Oni", "Ura": "Edit"}
+DEBUTS = ["Arcade", "NS1", "NS2", "PS Vita", "Nijiiro", "Blue", "Green"]
+TITLE_WORDS = ["Don", "Katsu", "Matsuri", "Yume", "Hoshi", "Sora", "Kaze",
+               "Hikari", "Rhythm", "Beat", "Drum", "Fever", "Dash", "Night"]
+
+SONG_BIN_SIZE = 4096
+VOLUME_OFFSET = 0x217
+FUMEN_HEADER_SIZE = 520
+# (good, ok, bad) timing windows, repeated 36 times in the header
+TIMING_WINDOWS = (25.025, 75.075, 108.1)
+DON, KA, DRUMROLL, BALLOON = 0x1, 0x4, 0x6, 0xA
+
+
+def synthetic_title(rng):
+    return " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(1, 4)))
+
+
+def fumen_bytes(rng, n_measures=12, order="<"):
+    header = bytearray(FUMEN_HEADER_SIZE)
+    struct.pack_into(order + "fff" * 36, header, 0, *(TIMING_WINDOWS * 36))
+    struct.pack_into(order + "i", header, 432, 0)  # has_branches
+    struct.pack_into(order + "ii", header, 436, 10000, 8000)  # HP max/clear
+    struct.pack_into(order + "i", header, 512, n_measures)
+    chunks = [bytes(header)]
+    for measure_idx in range(n_measures):
+        chunks.append(struct.pack(order + "ffBBHiiiiiii", 150.0,
+                                  measure_idx * 1600.0, 0, 1, 0,
+                                  -1, -1, -1, -1, -1, -1, 0))
+        notes = []
+        for note_idx in range(rng.randint(1, 8)):
+            # Every measure starts on a Don, so that no course has 0 notes
+            note_type = (DON if note_idx == 0 else
+                         rng.choice([DON, DON, KA, KA, DRUMROLL, BALLOON]))
+            hits = rng.randint(5, 20) if note_type == BALLOON else 0
+            duration = (400.0 if note_type in (DRUMROLL, BALLOON) else 0.0)
+            note = struct.pack(order + "ififHHf", note_type,
+                               note_idx * 200.0, 0, 0.0,
+                               hits if hits else 740, 0 if hits else 200,
+                               duration)
+            if note_type == DRUMROLL:
+                note += bytes(8)
+            notes.append(note)
+        # Only the 'normal' branch has notes
+        chunks.append(struct.pack(order + "HHf", len(notes), 0, 1.0))
+        chunks.extend(notes)
+        chunks.append(struct.pack(order + "HHf", 0, 0, 1.0) * 2)
+    return b"".join(chunks)
+
+
+def song_bin_bytes(volume=1.0, size=SONG_BIN_SIZE):
+    song_bin = bytearray(size)
+    song_bin[:4] = b"@UTF"
+    struct.pack_into(">f", song_bin, VOLUME_OFFSET, volume)
+    return bytes(song_bin)
+
+
+def synthetic_stars(rng):
+    star_mania = rng.randint(1, 10)
+    return {
+        'Easy': rng.randint(1, 5),
+        'Normal': rng.randint(2, 7),
+        'Hard': rng.randint(3, 8),
+        'Mania': star_mania,
+        'Ura': rng.choice([0, 0, 0, rng.randint(star_mania, 10)]),
+    }
+
+
+def datajson_dict(song_id, rng, title=None, stars=None, gzipped=False,
+                  tja_hash="0"):
+    # The fields that TakoTako writes (the rest get filled in on import)
+    title = title or synthetic_title(rng)
+    stars = stars or synthetic_stars(rng)
+    json_dict = {
+        'id': song_id,
+        'uniqueId': rng.randint(1, 0xFFFF_FFF),
+        'genreNo': rng.randint(0, 7),
+        'songFileName': f"song_{song_id}",
+        'songName': {'text': title, 'font': 1},
+        'songSubtitle': {'text': f"from {synthetic_title(rng)}", 'font': 1},
+        'songDetail': {'text': "", 'font': 1},
+        'previewPos': rng.randint(0, 60000),
+        'fumenOffsetPos': rng.choice([-2000, 0, 2000]),
+        'tjaFileHash': tja_hash,
+        'areFilesGZipped': gzipped,
+    }
+    for course, _ in COURSES:
+        json_dict[f'star{course}'] = stars[course]
+        json_dict[f'branch{course}'] = False
+        json_dict[f'shinuti{course}'] = 0
+        json_dict[f'shinuti{course}Duet'] = 0
+        json_dict[f'score{course}'] = 0
+    return json_dict
+
+
+def write_song(song_dir, json_dict, rng, volume=1.0):
+    # Writes data.json, song_[id].bin and a fumen for each rated course
+    os.makedirs(song_dir, exist_ok=True)
+    song_id = json_dict['id']
+    with open(os.path.join(song_dir, "data.json"), "w",
+              encoding="utf-8") as fp:
+        json.dump(json_dict, fp, ensure_ascii=False, indent="\t")
+    with open(os.path.join(song_dir, f"song_{song_id}.bin"), "wb") as fp:
+        fp.write(song_bin_bytes(volume))
+    for course, suffix in COURSES:
+        if not json_dict[f'star{course}']:
+            continue
+        fumen = fumen_bytes(rng, n_measures=rng.randint(8, 16))
+        if json_dict['areFilesGZipped']:
+            fumen = gzip.compress(fumen, compresslevel=1)
+        with open(os.path.join(song_dir, f"{song_id}_{suffix}.bin"),
+                  "wb") as fp:
+            fp.write(fumen)
+
+
+def tja_text(title, stars):
+    lines = [f"TITLE:{title}", "SUBTITLE:--Synthetic", "BPM:150",
+             "WAVE:audio.ogg", "OFFSET:0", "DEMOSTART:10", ""]
+    for course, tja_course in TJA_COURSES.items():
+        if not stars[course]:
+            continue
+        lines += [f"COURSE:{tja_course}", f"LEVEL:{stars[course]}",
+                  "BALLOON:", "SCOREINIT:", "SCOREDIFF:", "", "#START",
+                  "1010201011102010,", "1122,", "0,", "#END", ""]
+    return "\n".join(lines)
+
+
+def write_tja_folder(tja_dir, rng):
+    # Titles need to be unique, since importing a converted TJA renames its
+    # folder after the song's title
+    os.makedirs(tja_dir, exist_ok=True)
+    title = f"{synthetic_title(rng)} {os.path.basename(tja_dir)}"
+    with open(os.path.join(tja_dir, f"{os.path.basename(tja_dir)}.tja"), "w",
+              encoding="utf-8") as fp:
+        fp.write(tja_text(title, synthetic_stars(rng)))
+    with open(os.path.join(tja_dir, "audio.ogg"), "wb") as fp:
+        fp.write(b"OggS" + bytes(1020))
+
+
+def parse_tja_header(tja_path):
+    # Just enough TJA parsing for `fake_tjaconvert.py`
+    title, stars, course = "", {course: 0 for course, _ in COURSES}, None
+    tja_to_course = {v: k for k, v in TJA_COURSES.items()}
+    with open(tja_path, encoding="utf-8") as fp:
+        for line in fp:
+            key, _, value = line.strip().partition(":")
+            if key == "TITLE":
+                title = value
+            elif key == "COURSE":
+                course = tja_to_course.get(value)
+            elif key == "LEVEL" and course is not None:
+                stars[course] = int(value)
+    return title, stars
+
+
+def tja_song_id(tja_path):
+    return "tja" + hashlib.sha1(tja_path.encode("utf-8")).hexdigest()[:6]
+
+
+def synthetic_metadata(json_dict, rng):
+    # The extra columns that only live in the metadata spreadsheet
+    star_max = max(json_dict[f'star{course}'] for course, _ in COURSES)
+    return dict(json_dict, **{
+        'starMax': star_max,
+        'date': f"{rng.randint(2004, 2024)}-{rng.randint(1, 12):02d}-"
+                f"{rng.randint(1, 28):02d}",
+        'debut': rng.choice(DEBUTS),
+        'source': "Synthetic",
+        'volume': rng.choice([1.0, 1.0, 0.8, 1.2]),
+        'clearTier': rng.choice(["", "Strong", "Difficult", "Moderate"]),
+        'dfcTier': rng.choice(["", "S", "A", "B", "C"]),
+        'clearTierUra': "",
+        'dfcTierUra': "",
+    })
+
+
+def build_library(root_dir, n_songs, n_tjas=0, gzip_ratio=0.1, seed=0):
+    # Returns {song ID: metadata} for every (non-TJA) song written
+    rng = random.Random(seed)
+    metadata = {}
+    for i in range(n_songs):
+        song_id = f"syn{i:06d}"
+        json_dict = datajson_dict(song_id, rng,
+                                  gzipped=rng.random() < gzip_ratio)
+        song_dir = os.path.join(root_dir, GENRE_DIRS[json_dict['genreNo']],
+                                song_id)
+        metadata[song_id] = synthetic_metadata(json_dict, rng)
+        write_song(song_dir, json_dict, rng,
+                   volume=rng.choice([1.0, metadata[song_id]['volume']]))
+    for i in range(n_tjas):
+        write_tja_folder(os.path.join(root_dir, "TJAs", f"tja{i:05d}"), rng)
+    return metadata
+
+
+def flatten(json_dict):
+    flat = {}
+    for key, value in json_dict.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                flat[f"{key}_{sub_key}"] = sub_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def sheet_value(value):
+    # Google Sheets hands everything back as strings, "TRUE"/"FALSE" included
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return str(value)
+
+
+def metadata_rows(metadata, schema):
+    # Header + one row per song, as the sheet would hand them back.
+    # `schema` maps column names to types, like `CSV_HEADERS` does.
+    rows = [list(schema)]
+    for json_dict in metadata.values():
+        flat = flatten(json_dict)
+        rows.append([sheet_value(flat.get(key, type_func()))
+                     for key, type_func in schema.items()])
+    return rows
+
+
+def write_save_json(save_path, song_uids, played_ratio=0.3, seed=0):
+    # `song_uids` maps song IDs to TakoTako UIDs
+    rng = random.Random(seed)
+    records = {}
+    for uid in song_uids.values():
+        if rng.random() >= played_ratio:
+            continue
+        records[uid] = [{'c': rng.randint(0, 3),
+                         'h': {'s': rng.randint(100_000, 1_000_000),
+                               'e': rng.randint(0, 800),
+                               'g': rng.randint(0, 100),
+                               'b': rng.randint(0, 50),
+                               'r': rng.randint(0, 200),
+                               'c': rng.randint(0, 800)}}
+                        for _ in COURSES]
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    with open(save_path, "w", encoding="utf-8") as fp:
+        json.dump({'m': {}, 'r': records}, fp)
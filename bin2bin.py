@@ -1,36 +1,162 @@
+import argparse
 import glob
 import re
 import os
 import sys
 import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import file_digest, load_json_cache, write_json_atomic
 
 msg = """
 To use this script, make sure that you:
 
   - Download and install Python.
-  - Save this file in the main folder with all of the fumen folders.
+  - Run this script from the main folder with all of the fumen folders.
   - Put tja2fumen.exe in the main folder with all of the fumen folders.
 """
-print(msg)
-CUSTOM_SONG_DIR = os.getcwd()
-print(f"Looking for tja2fumen.exe in {CUSTOM_SONG_DIR}")
-tja2fumen_exes = glob.glob(os.path.join(CUSTOM_SONG_DIR, "tja2fumen*.exe"))
-if not tja2fumen_exes:
-    print("Could not find tja2fumen.exe in files.")
+
+FUMEN_BIN_RE = re.compile(r"^(.+)_([ehmnx])(_\d)?\.bin$")
+MANIFEST_NAME = "bin2bin_manifest.json"
+MANIFEST_VERSION = 1
+# Save progress every this many repaired files, so that an interrupted run
+# doesn't have to redo them
+SAVE_EVERY = 50
+
+RepairResult = namedtuple("RepairResult", ["path", "status", "message"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Repair every fumen .bin under the current folder with "
+                    "tja2fumen.exe, skipping files repaired by a previous "
+                    "run.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Number of tja2fumen.exe processes to run at "
+                             "once (default: # of CPUs).")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="Seconds to wait for tja2fumen.exe on a single "
+                             "file before giving up on it (default: 60).")
+    return parser.parse_args(argv)
+
+
+def file_record(filepath, old_record=None):
+    stat = os.stat(filepath)
+    # Only re-hash files that were touched since the last run
+    if (old_record is not None and old_record['size'] == stat.st_size
+            and old_record['mtime'] == stat.st_mtime_ns):
+        return old_record
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'digest': file_digest(filepath)}
+
+
+def load_manifest(manifest_path):
+    manifest = load_json_cache(manifest_path, MANIFEST_VERSION)
+    return {} if manifest is None else manifest['files']
+
+
+def save_manifest(manifest_path, files):
+    write_json_atomic(manifest_path, {'version': MANIFEST_VERSION,
+                                      'files': files},
+                      indent=1, sort_keys=True)
+
+
+def find_fumen_bins(root_dir):
+    fumen_bins = set()
+    for root, dirs, files in os.walk(root_dir, topdown=True):
+        for file_name in files:
+            if FUMEN_BIN_RE.match(file_name):
+                fumen_bins.add(os.path.join(root, file_name))
+    return fumen_bins
+
+
+def is_repaired(filepath, entry):
+    # The file still has the exact bytes that tja2fumen wrote last time
+    if entry is None:
+        return False
+    output = entry['output']
+    return file_record(filepath, output)['digest'] == output['digest']
+
+
+def repair_bin(tja2fumen, filepath, timeout=None):
+    input_record = file_record(filepath)
+    try:
+        proc = subprocess.run([tja2fumen, filepath],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return RepairResult(filepath, "failed",
+                            f"timed out after {timeout}s"), None
+    except OSError as e:
+        return RepairResult(filepath, "failed", str(e)), None
+    output = proc.stdout.decode('utf-8', errors='replace').strip()
+    if proc.returncode != 0 or not os.path.isfile(filepath):
+        return RepairResult(filepath, "failed", output), None
+    entry = {'input': input_record, 'output': file_record(filepath)}
+    return RepairResult(filepath, "converted", output), entry
+
+
+def print_summary(results):
+    for status in ["converted", "skipped", "failed"]:
+        n_files = sum(result.status == status for result in results)
+        print(f"  {n_files} {status}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(msg)
+    CUSTOM_SONG_DIR = os.getcwd()
+    print(f"Looking for tja2fumen.exe in {CUSTOM_SONG_DIR}")
+    tja2fumen_exes = glob.glob(os.path.join(CUSTOM_SONG_DIR,
+                                            "tja2fumen*.exe"))
+    if not tja2fumen_exes:
+        print("Could not find tja2fumen.exe in files.")
+        input("Press Enter to continue...")
+        sys.exit(1)
+    tja2fumen = tja2fumen_exes[0]
+    print(f"Using {tja2fumen}...")
+
+    print(f"\nLooking for .bin files in {CUSTOM_SONG_DIR}")
+    manifest_path = os.path.join(CUSTOM_SONG_DIR, MANIFEST_NAME)
+    old_manifest = load_manifest(manifest_path)
+    # Entries for files that no longer exist get dropped
+    manifest = {}
+    results, to_repair = [], []
+    for filepath in sorted(find_fumen_bins(CUSTOM_SONG_DIR)):
+        relpath = os.path.relpath(filepath, CUSTOM_SONG_DIR)
+        if is_repaired(filepath, old_manifest.get(relpath)):
+            manifest[relpath] = old_manifest[relpath]
+            results.append(RepairResult(filepath, "skipped", ""))
+        else:
+            to_repair.append(filepath)
+    print(f"Found {len(results) + len(to_repair)} .bin files "
+          f"({len(results)} already repaired)")
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            for i, (result, entry) in enumerate(executor.map(
+                    lambda fp: repair_bin(tja2fumen, fp,
+                                          timeout=args.timeout),
+                    to_repair), start=1):
+                print(f"- {result.status.upper()}: {result.path}")
+                if result.message:
+                    print(result.message)
+                if entry is not None:
+                    relpath = os.path.relpath(result.path, CUSTOM_SONG_DIR)
+                    manifest[relpath] = entry
+                results.append(result)
+                if i % SAVE_EVERY == 0:
+                    save_manifest(manifest_path, manifest)
+    finally:
+        # Also keeps the progress made so far if the run gets interrupted
+        save_manifest(manifest_path, manifest)
+
+    print("\nSummary:")
+    print_summary(results)
     input("Press Enter to continue...")
-    sys.exit(1)
-tja2fumen = tja2fumen_exes[0]
-print(f"Using {tja2fumen}...")
-print(f"\nLooking for .bin files in {CUSTOM_SONG_DIR}")
-processed_files = []
-for root, dirs, files in os.walk(CUSTOM_SONG_DIR, topdown=True):
-    for file_name in files:
-        match = re.match(r"^(.+)_([ehmnx])(_\d)?\.bin$", file_name)
-        if match:
-            filepath = os.path.join(root, file_name)
-            if filepath not in processed_files:
-                command = f'{tja2fumen} "{filepath}"'
-                print(f'Running {command}')
-                print(subprocess.check_output(command, shell=True).decode('utf-8'))
-                processed_files.append(filepath)
-input("Press Enter to continue...")
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    main()
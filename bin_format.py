@@ -0,0 +1,58 @@
+"""
+Header-only classification of TDMX `.bin` files.
+
+Only the first `HEADER_SIZE` bytes of a file are needed to tell whether it's
+still encrypted, gzipped, a raw fumen or a raw song, so already-processed
+libraries can be checked without reading whole files.
+"""
+
+import math
+import struct
+
+GZIP_MAGIC = b"\x1f\x8b"
+UTF_MARKER = b"@UTF"
+FUMEN_HEADER_SIZE = 520
+HEADER_SIZE = FUMEN_HEADER_SIZE
+
+ENCRYPTED = "encrypted"
+GZIPPED = "gzipped"
+RAW_FUMEN = "raw fumen"
+RAW_SONG = "raw song"
+
+
+def is_gzip_header(head):
+    # Magic bytes + "deflate" compression method + no reserved flags set
+    return (len(head) >= 4 and head.startswith(GZIP_MAGIC)
+            and head[2] == 8 and head[3] & 0xE0 == 0)
+
+
+def is_fumen_header(head):
+    if len(head) < FUMEN_HEADER_SIZE:
+        return False
+    # Same byte order check as tja2fumen: the measure count at bytes 512-515
+    # is far smaller when read with the right endianness
+    big, = struct.unpack_from(">I", head, 512)
+    little, = struct.unpack_from("<I", head, 512)
+    order = ">" if big < little else "<"
+    n_measures = min(big, little)
+    has_branches, = struct.unpack_from(order + "i", head, 432)
+    # Bytes 0-431 are 36 (good, ok, bad) timing windows, in milliseconds
+    good, ok, bad = struct.unpack_from(order + "fff", head, 0)
+    return (0 < n_measures < 100_000 and has_branches in (0, 1)
+            and all(math.isfinite(w) for w in (good, ok, bad))
+            and 0 < good <= ok <= bad < 1000)
+
+
+def classify_bytes(head):
+    if head.startswith(UTF_MARKER):
+        return RAW_SONG
+    if is_gzip_header(head):
+        return GZIPPED
+    if is_fumen_header(head):
+        return RAW_FUMEN
+    return ENCRYPTED
+
+
+def classify_bin(fpath):
+    with open(fpath, "rb") as fp:
+        return classify_bytes(fp.read(HEADER_SIZE))
@@ -1,97 +1,134 @@
 import os
 import json
+import argparse
+import contextlib
+import copy
 import csv
-import unicodedata
-import re
-from copy import deepcopy
 import shutil
-import math
 import gzip
-import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas
-import pygsheets
+# NB: pandas, pygsheets and tja2fumen are slow to import, so they're only
+# imported inside the functions that actually need them. The same goes for
+# numpy, and so for `metadata_table`, `tiers` and `song_order`, which are
+# built on it.
 
-from tjaconvert.main import convert_tja
-from tja2fumen import parse_fumen
+from tjaconvert.main import convert_tjas
 import utils as tdmx_utils
+from scan_manifest import (scan_library, iter_dirs, datajson_records,
+                           file_matches)
+from note_count_cache import load_note_counts, save_note_counts
+from gsheet_sync import sync_rows
+from bin_format import classify_bin, GZIPPED
+from song_volume import sync_volumes
+from song_import import fix_score, import_new_songs
+from uid_table import song_uids, find_collisions, reassign_unique_ids
+from instrumentation import RECORDER, stage
 import upload_scores_to_gsheet as upload_utils
 
-# FutureWarning: Downcasting object dtype arrays on .fillna, .ffill, .bfill is
-# deprecated and will change in a future version. Call
-# result.infer_objects(copy=False) instead. To opt-in to the future behavior,
-# set `pd.set_option('future.no_silent_downcasting', True)`
-#   df = df.fillna(nan)
-pandas.set_option('future.no_silent_downcasting', True)
-
 CUSTOMSONG_DIR = os.path.join("C:\\", "Users", "Joshua", "Saved Games", "TaikoTDM", "customSongs")
 PLAYLIST_DIR = os.path.join("C:\\", "Users", "Joshua", "Saved Games", "TaikoTDM", "BepInEx", "data",
                             "AdditionalFilterOptions", "CustomPlaylists")
 SHEET_NAME = 'taiko-metadata'
 CSV_FILENAME = 'metadata.csv'
 
-# Load song data from files
-data_jsons = tdmx_utils.load_data_jsons(CUSTOMSONG_DIR)
-_, scores = tdmx_utils.load_takotako_save_json_with_songids(data_jsons.keys())
-
-# Convert song data into high score spreadsheet
-entries = upload_utils.generate_highscore_spreadsheet(data_jsons, scores)
-
 ###############################################################################
 #                               Loading functions                             #
 ###############################################################################
 
 
-def find_song_folders(root_dir):
-    song_dirs = {}
-    for root, dirs, files in os.walk(root_dir, topdown=True):
-        song_id = None
-        for file_name in files:
-            match = re.match(r"^song_(.+)\.bin$", file_name)
-            if match:
-                song_id = match.group(1)
-                break
-        if song_id is not None:
-            song_dirs[song_id] = root
-    return song_dirs
+def import_pandas():
+    import pandas
+    # FutureWarning: Downcasting object dtype arrays on .fillna, .ffill,
+    # .bfill is deprecated and will change in a future version. Call
+    # result.infer_objects(copy=False) instead. To opt-in to the future
+    # behavior, set `pd.set_option('future.no_silent_downcasting', True)`
+    #   df = df.fillna(nan)
+    pandas.set_option('future.no_silent_downcasting', True)
+    return pandas
 
 
-def find_datajson_folders(root_dir):
+def load_highscore_entries(datajson_paths=None):
+    # Load song data from files (from the folders that `find_datajson_folders`
+    # already found, if given, rather than scanning customSongs again)
+    if datajson_paths is None:
+        data_jsons = tdmx_utils.load_data_jsons(CUSTOMSONG_DIR)
+    else:
+        data_jsons = tdmx_utils.read_data_jsons(datajson_paths.values())
+    _, scores = tdmx_utils.load_takotako_save_json_with_songids(
+        data_jsons.keys())
+    # Convert song data into high score spreadsheet
+    return upload_utils.generate_highscore_spreadsheet(data_jsons, scores)
+
+
+def scan_library_stage(root_dir):
+    with stage("scan") as record:
+        manifest = scan_library(root_dir)
+        record.count(items=len(manifest['dirs']))
+    return manifest
+
+
+def find_song_folders(manifest):
+    return {entry['song_bin']: root
+            for root, entry in iter_dirs(manifest)
+            if entry['song_bin'] is not None}
+
+
+def find_datajson_folders(manifest, max_workers=None, timeout=None):
+    # Converts any pending TJAs first, and returns the (possibly rescanned)
+    # manifest along with the folders, for the later stages to reuse
+    pending_dirs = [root for root, entry in iter_dirs(manifest)
+                    if entry['tja'] and not entry['subdirs']]
+    if pending_dirs:
+        print(f"Converting {len(pending_dirs)} TJA folder(s)...")
+        with stage("convert") as record:
+            results = convert_tjas(pending_dirs, max_workers, timeout)
+            record.count(items=len(results))
+        report_conversions(results)
+        # Pick up the `[GENERATED]` folders that TJAConvert.exe just created
+        manifest = scan_library_stage(manifest['root'])
+    return datajson_folders(manifest), manifest
+
+
+def datajson_folders(manifest):
     datajson_dirs = {}
-    for root, dirs, files in os.walk(root_dir, topdown=True):
-        if any([f.endswith(".tja") for f in files]) and not dirs:
-            errno, output, gen_dir = convert_tja(root)
-            if errno != 0:
-                print(f"TJAConvert.exe failed with exit code {errno}\n")
-            print(output)
-            if gen_dir:
-                root = gen_dir
-        json_path = os.path.join(root, "data.json")
-        if not os.path.isfile(json_path):
+    for root, entry in iter_dirs(manifest):
+        if entry['datajson'] is None:
             continue
-        with open(json_path, encoding="utf-8-sig") as f:
-            try:
-                json_dict = json.load(f)
-                song_id = json_dict['id']
-                datajson_dirs[song_id] = root
-            except Exception:  # noqa, e.g. if data.json is empty
-                print(f"  - WARNING: Cannot read {json_path}")
+        song_id = entry['datajson']['id']
+        if song_id is None:  # e.g. if data.json is empty
+            json_path = os.path.join(root, 'data.json')
+            print(f"  - WARNING: Cannot read {json_path}")
+            continue
+        datajson_dirs[song_id] = root
     return datajson_dirs
 
 
+def report_conversions(results):
+    failed = [r for r in results if r.errno != 0]
+    for result in results:
+        status = "FAILED" if result.errno != 0 else "Converted"
+        print(f"- {status}: {result.root_dir}")
+        if result.errno != 0:
+            print(f"    TJAConvert.exe failed with exit code {result.errno}")
+        if result.message:
+            print("    " + result.message.replace("\n", "\n    "))
+    print(f"\n# of TJAs converted: {len(results) - len(failed)} "
+          f"({len(failed)} failed)")
+
+
 def load_metadata_from_gsheet(sheet_name, idx=0):
+    import pygsheets
+    import_pandas()
     gc = pygsheets.authorize(service_file='credentials.json')
     sh = gc.open(sheet_name)
     wks = sh[idx]
     df = wks.get_as_df()
-    header = [df.keys().tolist()]
-    # Google Sheets converts boolean values to "FALSE" and "TRUE", so want
-    # to make sure we interpret these strings as boolean values
-    BOOLEAN_STR_MAP = {'FALSE': False, 'False': False, 'false': False,
-                       'TRUE': True,   'True': True,   'true': True}
-    rows = [[value if value not in BOOLEAN_STR_MAP else BOOLEAN_STR_MAP[value]
-             for value in row] for row in df.values.tolist()]
-    return header + rows
+    # NB: Google Sheets converts boolean values to "FALSE" and "TRUE", which
+    # `MetadataTable` takes care of when coercing the bool columns
+    return [df.keys().tolist()] + df.values.tolist()
 
 
 ###############################################################################
@@ -164,351 +201,227 @@ DEFAULT_CSV_VALUES = {key: type_func()
 
 
 def jsons_to_csv(jsons):
-    csv_list = [list(CSV_HEADERS.keys())]
-    for json_dict in jsons.values():
-        json_dict = flatten_dict(json_dict)
-        assert len(json_dict.keys()) == len(CSV_HEADERS.keys())
-        csv_list.append([json_dict[k] for k in CSV_HEADERS.keys()])
-    return csv_list
+    from metadata_table import MetadataTable
+    return MetadataTable.from_jsons(jsons, CSV_HEADERS).to_rows()
 
 
 def csv_to_jsons(csv_list):
-    jsons = {}
-    keys = csv_list[0]
-    for values in csv_list[1:]:
-        json_dict = {}
-        for k, v in zip(keys, values):
-            if CSV_HEADERS[k] == bool:
-                json_dict[k] = (v in ["True", True])
-            else:
-                json_dict[k] = CSV_HEADERS[k](v)
-
-        # make sure data.json dict has all keys from csv
-        for key, default_value in DEFAULT_CSV_VALUES.items():
-            if key not in json_dict.keys():
-                print(f"- WARNING: {json_dict['id']} is missing key '{key}'")
-                json_dict[key] = default_value
-
-        json_dict = unflatten_dict(json_dict)
-        jsons[json_dict['id']] = json_dict
+    from metadata_table import MetadataTable
+    jsons = MetadataTable.from_rows(csv_list, CSV_HEADERS).to_jsons()
     jsons = {k: jsons[k] for k in sorted(jsons.keys())}
     return jsons
 
 
-def flatten_dict(nested_dict):
-    flattened_dict = {}
-    for outer_key, outer_val in nested_dict.items():
-        if isinstance(outer_val, dict):
-            for inner_key, inner_val in outer_val.items():
-                flattened_dict[f"{outer_key}_{inner_key}"] = inner_val
-        else:
-            flattened_dict[outer_key] = outer_val
-
-    return flattened_dict
-
-
-def unflatten_dict(flat_dict):
-    nested_dict = {}
-    for key, value in flat_dict.items():
-        subkeys = key.split("_")
-        if len(subkeys) == 1:
-            nested_dict[key] = value
-        else:
-            if subkeys[0] not in nested_dict.keys():
-                nested_dict[subkeys[0]] = {}
-            nested_dict[subkeys[0]][subkeys[1]] = value
-
-    return nested_dict
-
-
 ###############################################################################
 #                          Processing functions (.tja)                        #
 ###############################################################################
 
 
-def load_missing_datajson_metadata(root):
-    # Load values generated by TakoTako
-    json_path = os.path.join(root, "data.json")
-    json_dict = flatten_dict(tdmx_utils.read_json(json_path))
-    # Add default values if missing
-    json_dict = {key: type_func(json_dict[key]) if key in json_dict
-                 else type_func()
-                 for key, type_func in CSV_HEADERS.items()}
-    json_dict = unflatten_dict(json_dict)
-    # Fix TakoTako's buggy fumenOffsetPos (`{0, 2000} - offset`)
-    old_offset = json_dict['fumenOffsetPos']
-    json_dict['fumenOffsetPos'] = 0 if old_offset <= 0 else 2000
-    # Set default values for fields with nonzero defaults
-    json_dict['volume'] = 1.0
-    json_dict['starMax'] = max(
-        json_dict['starEasy'],
-        json_dict['starNormal'],
-        json_dict['starHard'],
-        json_dict['starMania'],
-        json_dict['starUra']
-    )
-    json_dict['date'] = '2088-08-08'
-    json_dict['songName']['font'] = "1"
-    print(f"- Imported {json_dict['songName']['text']} "
-          f"({json_dict['songSubtitle']['text']})")
-    return json_dict
+GUNZIP_STATUSES = ["decompressed", "raw", "corrupt", "failed"]
 
 
 def gunzip_file(root, fname):
     fpath = os.path.join(root, fname)
-    tmp_fpath = os.path.join(root, "temp.bin")
     try:
-        with gzip.open(fpath, 'rb') as f_in:
-            with open(tmp_fpath, 'wb') as f_out:
+        if classify_bin(fpath) != GZIPPED:
+            return "raw"
+        # Unique temp name, so that several folders can be gunzipped at once
+        fd, tmp_fpath = tempfile.mkstemp(dir=root, prefix=f"{fname}.",
+                                         suffix=".tmp")
+        try:
+            with gzip.open(fpath, 'rb') as f_in, os.fdopen(fd, 'wb') as f_out:
                 shutil.copyfileobj(f_in, f_out)
-        print(f"    Successfully gunzipped {fname}")
-        os.remove(fpath)
-        shutil.move(tmp_fpath, fpath)
-        return True
-    except Exception as e:
-        # print(f"    {fname} couldn't be gunzipped: {e}")
-        return False
+            os.replace(tmp_fpath, fpath)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_fpath)
+            raise
+    except (gzip.BadGzipFile, EOFError, zlib.error):
+        return "corrupt"
+    except OSError:  # e.g. disk full, or file locked/deleted mid-sync
+        return "failed"
+    return "decompressed"
 
 
 def gunzip_files(root):
-    for file in os.listdir(root):
+    result = {status: [] for status in GUNZIP_STATUSES}
+    for file in sorted(os.listdir(root)):
         if file.endswith(".bin"):
-            gunzip_file(root, file)
-    print("All files gunzipped!")
-    return False
-
-
-def count_notes(fumen, dur):
-    n_notes = 0
-    n_balloon = 0
-    n_drumroll = 0
-    for measure in fumen.measures:
-        if measure.branches['master'].length:
-            branch = measure.branches['master']
-        else:
-            branch = measure.branches['normal']
-        for note in branch.notes:
-            if (note.note_type.lower().startswith('don') or
-                    note.note_type.lower().startswith('ka')):
-                n_notes += 1
-            elif note.note_type.lower() == 'balloon':
-                if note.hits >= 2 * (note.duration / dur) and note.hits > 15:
-                    # print(f"Troll balloon notes identified: {note.hits}")
-                    n_balloon += 2 * math.ceil(note.duration / dur)
-                else:
-                    n_balloon += note.hits
-            elif note.note_type.lower() == 'kusudama':
-                if note.hits >= 2 * (note.duration / dur) and note.hits > 15:
-                    # print(f"Troll kusudama notes identified: {note.hits}")
-                    n_balloon += 2 * math.ceil(note.duration / dur)
-                else:
-                    n_balloon += note.hits
-            elif note.note_type.lower() == 'drumroll':
-                n_drumroll += math.ceil(note.duration / dur)
-            else:
-                continue
-    return n_notes, n_balloon, n_drumroll
-
-
-def fix_score(json_dict, song_path):
-    difficulites = [("Easy", "e", 150),
-                    ("Normal", "n", 125),
-                    ("Hard", "h", 100),
-                    ("Mania", "m", 80),
-                    ("Ura", "x", 80)]
-    for (diff_name, diff_suffix, dur) in difficulites:
-        if json_dict[f"star{diff_name}"] == 0:
-            json_dict[f'score{diff_name}'] = 0
-            json_dict[f'shinuti{diff_name}'] = 0
+            result[gunzip_file(root, file)].append(file)
+    return result
+
+
+def gunzip_folders(roots, max_workers=None):
+    # Mostly waiting on disk I/O (zlib releases the GIL), so threads will do
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(roots, executor.map(gunzip_files, roots)))
+
+
+def report_gunzips(results):
+    totals = {status: 0 for status in GUNZIP_STATUSES}
+    for root, result in results.items():
+        for status in GUNZIP_STATUSES:
+            totals[status] += len(result[status])
+        for fname in result["corrupt"]:
+            print(f"- WARNING: {os.path.join(root, fname)} looks gzipped, "
+                  f"but couldn't be decompressed")
+        for fname in result["failed"]:
+            print(f"- WARNING: Couldn't read/write "
+                  f"{os.path.join(root, fname)}, left as-is")
+    print(f"# of .bin files gunzipped:        {totals['decompressed']} "
+          f"({totals['raw']} already raw, {totals['corrupt']} corrupt, "
+          f"{totals['failed']} failed)")
+
+
+def rescore_songs(jsons, paths, note_counts):
+    n_rescored = 0
+    for song_id, json_dict in jsons.items():
+        if song_id not in paths:
+            continue
+        if json_dict['areFilesGZipped']:
+            print(f"- WARNING: Skipping '{song_id}', its fumens are gzipped.")
+            continue
+        try:
+            fix_score(json_dict, paths[song_id], note_counts)
+        except Exception as e:  # noqa, e.g. missing or malformed fumen
+            print(f"- WARNING: Couldn't rescore '{song_id}': {e}")
             continue
-        # fetch song data from .bin files
-        song_id = json_dict['id']
-        fname_fumen = f"{song_id}_{diff_suffix}.bin"
-        fumen = parse_fumen(os.path.join(song_path, fname_fumen))
-        n_notes, n_hits, n_drumrolls = count_notes(fumen, dur)
-        # estimate a new value for the points per good
-        good_points_estimated = ((1000000 - ((n_hits + n_drumrolls) * 100))
-                                 / n_notes)
-        good_points_estimated_rounded = math.ceil(good_points_estimated
-                                                  / 10.0) * 10
-        top_score_estimated = ((good_points_estimated_rounded * n_notes)
-                               + (n_hits * 100) + (n_drumrolls * 100))
-
-        json_dict[f'score{diff_name}'] = top_score_estimated
-        json_dict[f'shinuti{diff_name}'] = good_points_estimated_rounded
-
-    return json_dict
-
-
-def update_volume(json_dict, par_dir):
-    VOLUME_TO_WRITE = json_dict['volume']
-    if VOLUME_TO_WRITE == 0:
-        VOLUME_TO_WRITE = 1.0
-
-    song_id = json_dict['id']
-    song_path = os.path.join(par_dir, f"song_{song_id}.bin")
-    with open(song_path, mode="rb+") as fp:
-        byte_string = struct.pack(">f", VOLUME_TO_WRITE)
-        fp.seek(0x217)
-        fp.write(byte_string)
-        print(f"Writing {VOLUME_TO_WRITE} for {song_id}.")
-
-
-def safe_filename(string):
-    return "".join(c for c in string
-                   if c.isalpha() or c.isdigit() or c == ' ').rstrip()
-
-
-def fix_tja_parent_dirname(song_json, song_path):
-    is_tja = song_json['tjaFileHash'] != '0'
-    if not is_tja or "[GENERATED]" not in song_path:
-        return song_path
-    gen_dir = os.path.basename(song_path)
-    parent_dir = os.path.abspath(os.path.join(song_path, '..'))
-    song_name = song_json['songName']['text']
-    new_name = safe_filename(song_name)
-    new_dir = os.path.join(
-        os.path.abspath(os.path.join(parent_dir, '..')),
-        new_name
-    )
-    if new_dir != parent_dir:
-        os.rename(parent_dir, new_dir)
-    song_path_new = os.path.join(new_dir, gen_dir)
-    return song_path_new
+        n_rescored += 1
+    return n_rescored
+
+
+def report_volume_syncs(results, dry_run=False):
+    n_mismatched = 0
+    for result in results:
+        if result.status in ("patched", "mismatch"):
+            n_mismatched += 1
+            action = "Would write" if dry_run else "Wrote"
+            print(f"- {action} {result.new_volume} for {result.song_id} "
+                  f"(was {result.old_volume})")
+        elif result.status != "ok":
+            print(f"- WARNING: Couldn't check the volume of "
+                  f"{result.path} ({result.status})")
+    label = ("# of volumes to patch:" if dry_run
+             else "# of volumes patched:").ljust(34)
+    print(f"{label}{n_mismatched} (of {len(results)} songs)")
+
+
+def import_songs(metadata_dicts, datajson_paths, song_paths, note_counts,
+                 max_workers=None):
+    # Imports the songs on disk that aren't in the metadata yet, and merges
+    # them into `metadata_dicts`/the path dicts (all updated in place)
+    new_song_ids = sorted(set(datajson_paths) - set(metadata_dicts))
+    with stage("import") as record:
+        report_gunzips(gunzip_folders([datajson_paths[song_id]
+                                       for song_id in new_song_ids],
+                                      max_workers=max_workers))
+        import_results = import_new_songs(new_song_ids, datajson_paths,
+                                          note_counts, CSV_HEADERS,
+                                          max_workers=max_workers)
+        record.count(items=len(import_results))
+    imported, import_failures = [], []
+    for result in import_results:  # Sorted by song ID
+        note_counts.update(result.note_counts)
+        if result.error is not None:
+            import_failures.append(result)
+            continue
+        metadata_dicts[result.song_id] = result.song_json
+        song_paths[result.song_id] = result.song_path
+        datajson_paths[result.song_id] = result.song_path
+        imported.append(result.song_id)
+    print(f"\n# of songs imported:              {len(imported)}")
+    for result in import_failures:
+        print(f"- WARNING: Couldn't import '{result.song_id}' "
+              f"({result.song_path}):\n{result.error}")
+    return imported
 
 
 ###############################################################################
 #                          Processing functions (.bin)                        #
 ###############################################################################
 
-def strip_accents(s):
-    return ''.join(c for c in unicodedata.normalize('NFD', s)
-                   if unicodedata.category(c) != 'Mn')
-
-
-def order_func(item):
-    return [
-        item['genreNo'],
-        (10 - item['starMax']),
-        strip_accents(item['songName']['text']).upper()
-    ]
-
-
-def order_func_2(item):
-    song_id = item['id']
-    song_id_ura = song_id + "_ura"
-    score_omote = (0 if (song_id not in entries
-                         or not entries[song_id]['Score'])
-                   else entries[song_id]['Score'])
-    score_ura = (0 if (song_id_ura not in entries
-                       or not entries[song_id_ura]['Score'])
-                 else entries[song_id_ura]['Score'])
-    if score_omote and not score_ura:
-        score_sort = score_omote
-        star_sort = item['starMania']
-    elif score_ura:
-        score_sort = score_ura
-        star_sort = item['starUra']
-    else:
-        score_sort = 0
-        star_sort = max(item['starMania'], item['starUra'])
-
-    has_score = any([score_ura, score_omote])
-    if has_score:
-        sort_value = [
-            "1",
-            item['genreNo'],
-            (10 - int(star_sort)),
-            (1_000_000 - int(score_sort)),
-            item['songName']['text'],
-        ]
-    else:
-        sort_value = [
-            "2",
-            item['genreNo'],
-            (99999999 - int(item['date'].replace('-', ''))),
-            item['debut'],
-            strip_accents(item['songName']['text']).upper()
-        ]
-
-    return sort_value
-
-
-def order_func_3(item):
-    return [
-        (99999999 - int(item['date'].replace('-', ''))),
-        item['debut'],
-        strip_accents(item['songName']['text']).upper()
-    ]
-
-
-def update_order(jsons):
+def update_order(jsons, entries=None, mode='score', datajson_paths=None):
+    from song_order import (ORDER_MODES, build_sort_keys, load_title_cache,
+                            save_title_cache)
+    if entries is None and mode == 'score':
+        entries = load_highscore_entries(datajson_paths)
+    title_cache = load_title_cache()
+    n_cached_titles = len(title_cache)
+    keys = build_sort_keys(jsons, entries, title_cache)
+    if len(title_cache) != n_cached_titles:
+        save_title_cache(title_cache)
+    json_list = list(jsons.values())
     ordered_jsons = {}
-    ordered_json_list = sorted([j for j in jsons.values()],
-                               key=order_func_2)
-    for new_order, json_file in enumerate(ordered_json_list):
+    for new_order, idx in enumerate(ORDER_MODES[mode](keys)):
+        json_file = json_list[idx]
         json_file['order'] = new_order
         ordered_jsons[json_file['id']] = json_file
     return ordered_jsons
 
 
-wikiwiki_map = {
-    'Extremely Difficult': 20,
-    'Difficult': 16,
-    'Strong': 12,
-    'Moderate': 8,
-    'Weak': 3,
-    'Misrepresentation': 0,
-}
+def compute_difficulty(jsons, weights=None):
+    from tiers import TIER_INPUT_COLUMNS, compute_tiers
+    song_jsons = list(jsons.values())
+    columns = {key: [json_dict[key] for json_dict in song_jsons]
+               for key in TIER_INPUT_COLUMNS}
+    combined, combined_ura = compute_tiers(columns, weights)
+    for json_dict, tier, tier_ura in zip(song_jsons, combined.tolist(),
+                                         combined_ura.tolist()):
+        json_dict['combinedTier'] = tier
+        json_dict['combinedTierUra'] = tier_ura
 
-discord_map = {
-    'SS': 20,
-    'S++': 19,
-    'S+': 18,
-    'S': 17,
-    'A+': 16,
-    'A': 13.5,
-    'B': 11,
-    'C': 8.5,
-    'D': 6,
-    'E': 3.5,
-    'F': 1,
-}
+    return jsons
 
 
-def difficult_formula(ww, d):
-    clear = -1 if ww not in wikiwiki_map else wikiwiki_map[ww]
-    dfc = -1 if d not in discord_map else discord_map[d]
-    w_clear, w_dfc = 0.0, 0.0
-    if clear >= 0 and dfc >= 0:
-        w_clear, w_dfc = 0.5, 0.5
-    elif clear >= 0:
-        w_clear = 1.0
-    elif dfc >= 0:
-        w_dfc = 1.0
-    return (w_clear * clear) + (w_dfc * dfc)
+def parse_tier_weight(arg):
+    from tiers import TIER_SOURCES
+    source, _, weight = arg.partition("=")
+    if source not in TIER_SOURCES:
+        raise argparse.ArgumentTypeError(
+            f"unknown tier source '{source}' (choose from "
+            f"{', '.join(TIER_SOURCES)})")
+    return source, float(weight)
 
 
-def compute_difficulty(jsons):
+def fix_song_names(jsons):
     for song_id, json_dict in jsons.items():
-        if json_dict['starMania'] == 10:
-            ww = json_dict['clearTier']
-            d = json_dict['dfcTier']
-            json_dict['combinedTier'] = difficult_formula(ww, d)
-        if json_dict['starUra'] == 10:
-            ww = json_dict['clearTierUra']
-            d = json_dict['dfcTierUra']
-            json_dict['combinedTierUra'] = difficult_formula(ww, d)
-            # Copy the ura rating into the oni rating if oni != 10
-            if json_dict['starMania'] != 10:
-                json_dict['combinedTier'] = json_dict['combinedTierUra']
+        json_dict['songFileName'] = f"song_{song_id}"
+    return jsons
 
+
+def fix_unique_ids(jsons):
+    collisions, reassigned = reassign_unique_ids(
+        {song_id: str(json_dict['uniqueId'])
+         for song_id, json_dict in jsons.items()})
+    for unique_id, song_ids in sorted(collisions.items()):
+        print(f"- uniqueId {unique_id} is shared by {len(song_ids)} songs "
+              f"(kept by '{song_ids[0]}')")
+    for song_id, unique_id in reassigned.items():
+        # Already a string, like every `uniqueId` (see `CSV_HEADERS`)
+        jsons[song_id]['uniqueId'] = unique_id
+    print(f"# of uniqueIds reassigned:        {len(reassigned)}")
+
+    # Derived UIDs come from the song ID, so these can only be reported
+    uid_collisions = find_collisions(song_uids(jsons))
+    for uid, song_ids in sorted(uid_collisions.items()):
+        print(f"- WARNING: Song IDs {song_ids} all map to TakoTako UID "
+              f"{uid}, so their scores will get mixed up. Rename all but "
+              f"one of them to fix this.")
     return jsons
 
 
-def fix_song_names(jsons):
-    for song_id, json_dict in jsons.items():
-        json_dict['songFileName'] = f"song_{song_id}"
+def update_metadata_fields(jsons, args, datajson_paths=None):
+    from tiers import DEFAULT_TIER_WEIGHTS
+    with stage("order") as record:
+        jsons = update_order(jsons, mode=args.order,  # Expects nested dicts
+                             datajson_paths=datajson_paths)
+        record.count(items=len(jsons))
+    tier_weights = {**DEFAULT_TIER_WEIGHTS, **dict(args.tier_weight)}
+    with stage("difficulty") as record:
+        jsons = compute_difficulty(jsons, tier_weights)
+        record.count(items=len(jsons))
+    jsons = fix_song_names(jsons)
+    jsons = fix_unique_ids(jsons)
     return jsons
 
 
@@ -523,9 +436,10 @@ def write_csv(csv_list):
         writer.writerows(csv_list)
 
 
-def write_jsons(jsons, paths):
+def write_jsons(jsons, paths, manifest=None):
+    records = datajson_records(manifest) if manifest else {}
+    written = []
     for song_id, song_json in jsons.items():
-        json_to_write = deepcopy(song_json)
         if song_id in paths:
             path = paths[song_id]
         else:
@@ -535,6 +449,9 @@ def write_jsons(jsons, paths):
                 print(f"WARNING: Song '{song_id}' present in spreadsheet, but "
                       f"missing on disk.")
             continue
+        # Only `songDetail` gets modified, so that's all that needs copying
+        json_to_write = dict(song_json)
+        json_to_write['songDetail'] = dict(song_json['songDetail'])
         if len(song_json['date']) > 4:
             d = f"「{song_json['debut']} - {song_json['date']}」"
             if song_json['songDetail']['text']:
@@ -544,9 +461,40 @@ def write_jsons(jsons, paths):
             pass  # json_to_write['songName']['text'] += ' *'
         str_to_write = json.dumps(json_to_write, indent="\t",
                                   ensure_ascii=False)
-        with open(os.path.join(path, "data.json"), "w", encoding="utf-8-sig") \
-                as outfile:
-            outfile.write(str_to_write)
+        bytes_to_write = str_to_write.encode("utf-8-sig")
+        json_path = os.path.join(path, "data.json")
+        if file_matches(json_path, bytes_to_write, records.get(path)):
+            continue
+        tdmx_utils.write_bytes_atomic(json_path, bytes_to_write)
+        written.append(json_path)
+    return written
+
+
+def write_metadata(metadata_dicts, song_paths, sheet_rows, manifest,
+                   changed=None):
+    # Writes metadata.csv, data.json files (only for the songs in `changed`,
+    # if given) and the spreadsheet. `manifest` is the sync's own scan, for
+    # skipping unchanged data.json files (folders renamed since then just
+    # get compared byte-for-byte).
+    print("Writing metadata to metadata.csv...")
+    with stage("write_csv") as record:
+        write_csv(jsons_to_csv(metadata_dicts))  # Sanity check
+        record.count(items=len(metadata_dicts),
+                     bytes_written=os.path.getsize(CSV_FILENAME))
+    print("Writing metadata to song data.json files...")
+    with stage("write_jsons") as record:
+        written = write_jsons(metadata_dicts if changed is None else changed,
+                              song_paths, manifest=manifest)
+        record.count(items=len(written),
+                     bytes_written=sum(os.path.getsize(json_path)
+                                       for json_path in written))
+    print(f"# of data.json files written:     {len(written)}")
+    print(f"Uploading metadata to Google Sheet '{SHEET_NAME}'...")
+    with stage("gsheet_upload") as record:
+        n_cells = write_metadata_to_gsheet(metadata_dicts, SHEET_NAME,
+                                           sheet_rows=sheet_rows)
+        record.count(items=n_cells)
+    print(f"# of spreadsheet cells updated:   {n_cells}")
 
 
 def write_playlists(song_jsons):
@@ -575,20 +523,37 @@ def write_playlists(song_jsons):
             outfile.write(str_to_write)
 
 
-def write_metadata_to_gsheet(metadata, sheet_name):
-    flattened_jsons = {sid: flatten_dict(json_dict)
-                       for sid, json_dict in metadata.items()}
-    sorted_jsons = {sid: {key: type_func(json_dict[key])
-                          for key, type_func in CSV_HEADERS.items()}
-                    for sid, json_dict in sorted(flattened_jsons.items(),
-                                                 key=lambda x: str(x[1]['date']),
-                                                 reverse=True)}
-    df_out = pandas.DataFrame.from_dict(sorted_jsons)
+def metadata_to_rows(metadata):
+    from metadata_table import MetadataTable
+    table = MetadataTable.from_jsons(metadata, CSV_HEADERS)
+    return table.take(table.argsort('date', reverse=True)).to_rows()
+
+
+def typed_sheet_rows(sheet_rows):
+    # Coerce the rows read from the sheet the same way `metadata_to_rows`
+    # does, so that only real changes show up when diffing the two
+    from metadata_table import MetadataTable
+    if sheet_rows[0] != list(CSV_HEADERS.keys()):
+        return None
+    return MetadataTable.from_rows(sheet_rows, CSV_HEADERS).to_rows()
+
+
+def write_metadata_to_gsheet(metadata, sheet_name, sheet_rows=None):
+    import pygsheets
+    new_rows = metadata_to_rows(metadata)
 
     gc = pygsheets.authorize(service_file='credentials.json')
     sh = gc.open(sheet_name)
     wks = sh.sheet1
-    wks.set_dataframe(df_out.transpose(), (1, 1))
+    old_rows = typed_sheet_rows(sheet_rows) if sheet_rows else None
+    n_cells = sync_rows(wks, old_rows, new_rows) if old_rows else None
+    if n_cells is None:
+        # Nothing reliable to diff against (or too much changed for a diff
+        # to be worth it), so upload the whole sheet
+        df_out = import_pandas().DataFrame(new_rows[1:], columns=new_rows[0])
+        wks.set_dataframe(df_out, (1, 1))
+        n_cells = len(new_rows) * len(new_rows[0])
+    return n_cells
 
 
 ###############################################################################
@@ -596,52 +561,195 @@ def write_metadata_to_gsheet(metadata, sheet_name):
 ###############################################################################
 
 
-def main():
+def parse_args(argv=None):
+    from tiers import DEFAULT_TIER_WEIGHTS
+    from song_order import ORDER_MODES
+    parser = argparse.ArgumentParser(
+        description="Sync customSongs data.json files with the metadata "
+                    "spreadsheet.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Number of TJAConvert.exe processes/song "
+                             "import workers to run at once "
+                             "(default: # of CPUs)")
+    parser.add_argument("--tja-timeout", type=float, default=300,
+                        help="Seconds to wait for each TJAConvert.exe job "
+                             "before giving up on it (default: 300)")
+    parser.add_argument("--rescore-all", action="store_true",
+                        help="Recompute scores for every song on disk, not "
+                             "just newly-imported ones")
+    parser.add_argument("--order", choices=ORDER_MODES.keys(),
+                        default='score',
+                        help="How to order songs in the song select menu: "
+                             "by best score, by genre/star rating, or by "
+                             "date (default: score)")
+    parser.add_argument("--tier-weight", type=parse_tier_weight,
+                        action="append", default=[],
+                        metavar="SOURCE=WEIGHT",
+                        help="Weight of a tier source in combinedTier, e.g. "
+                             "'dfc=0.7' (default: "
+                             + ", ".join(f"{s}={w}" for s, w in
+                                         DEFAULT_TIER_WEIGHTS.items())
+                             + ")")
+    parser.add_argument("--sync-volumes", action="store_true",
+                        help="Check the volume stored in every song's "
+                             "song_[id].bin against its 'volume' column, "
+                             "and patch the ones that differ")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="With --sync-volumes, only report the volumes "
+                             "that would be patched")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Write a JSON report with the time, item "
+                             "count, bytes read/written and peak RSS of "
+                             "each stage (rewritten after every sync in "
+                             "--watch mode)")
+    parser.add_argument("--report-memory", action="store_true",
+                        help="With --report, also trace each stage's own "
+                             "peak memory with tracemalloc (makes the sync "
+                             "several times slower)")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Run the sync under cProfile and dump the "
+                             "stats to PATH (for use with pstats/snakeviz)")
+    parser.add_argument("--watch", action="store_true",
+                        help="After syncing, keep watching customSongs and "
+                             "save.json, and sync again whenever songs get "
+                             "added or scores change (uses inotify on Linux "
+                             "if the optional inotify_simple package is "
+                             "installed, and polling otherwise)")
+    parser.add_argument("--watch-debounce", type=float, default=2.0,
+                        help="With --watch, seconds to wait for changes to "
+                             "stop before syncing, so that a whole song "
+                             "pack gets synced at once (default: 2)")
+    return parser.parse_args(argv)
+
+
+def watch_library(args, metadata_dicts, note_counts):
+    from library_watcher import LibraryWatcher
+    save_path = os.path.abspath(tdmx_utils.__takotako_save__)
+    watcher = LibraryWatcher(CUSTOMSONG_DIR, extra_files=[save_path],
+                             debounce=args.watch_debounce)
+    sheet_rows = metadata_to_rows(metadata_dicts)  # What the sheet has now
+    print(f"\nWatching {CUSTOMSONG_DIR} and {save_path} for changes "
+          f"({watcher.backend.name}). Press Ctrl+C to stop.")
+    while True:
+        changes = watcher.wait_for_changes()
+        save_changed = save_path in changes
+        n_library_changes = len(changes) - save_changed
+        print(f"\nDetected {n_library_changes} changed path(s) in "
+              f"customSongs" + (" + save.json" if save_changed else ""))
+        if args.report:
+            RECORDER.start(trace_memory=args.report_memory)
+        old_dicts = copy.deepcopy(metadata_dicts)
+
+        # Only the stages that the changes could affect get re-run
+        manifest = scan_library_stage(CUSTOMSONG_DIR)
+        imported = []
+        if n_library_changes:
+            datajson_paths, manifest = find_datajson_folders(
+                manifest, max_workers=args.jobs, timeout=args.tja_timeout)
+            song_paths = find_song_folders(manifest)
+            imported = import_songs(metadata_dicts, datajson_paths,
+                                    song_paths, note_counts, args.jobs)
+            if imported:
+                save_note_counts(note_counts)
+        else:
+            datajson_paths = datajson_folders(manifest)
+            song_paths = find_song_folders(manifest)
+        if imported:
+            metadata_dicts = update_metadata_fields(metadata_dicts, args,
+                                                    datajson_paths)
+        elif save_changed and args.order == 'score':
+            with stage("order") as record:
+                metadata_dicts = update_order(metadata_dicts, mode=args.order,
+                                              datajson_paths=datajson_paths)
+                record.count(items=len(metadata_dicts))
+
+        changed = {song_id: json_dict
+                   for song_id, json_dict in metadata_dicts.items()
+                   if old_dicts.get(song_id) != json_dict}
+        if changed:
+            print(f"# of songs changed:               {len(changed)}")
+            write_metadata(metadata_dicts, song_paths, sheet_rows, manifest,
+                           changed=changed)
+            sheet_rows = metadata_to_rows(metadata_dicts)
+        else:
+            print("Nothing to update.")
+        if args.report:
+            RECORDER.write_report(args.report, args=vars(args))
+
+
+def sync_library(args):
     # Upload high scores since last play
     # print("Uploading past high scores")
     # from upload_scores_to_gsheet import main as upload
     # upload()
 
-    # Fetch song paths from disk
-    datajson_paths = find_datajson_folders(CUSTOMSONG_DIR)
+    # Fetch song paths from disk. The library only gets scanned once (plus
+    # once more if TJAs got converted), and every later stage reuses that.
+    manifest = scan_library_stage(CUSTOMSONG_DIR)
+    datajson_paths, manifest = find_datajson_folders(manifest,
+                                                     max_workers=args.jobs,
+                                                     timeout=args.tja_timeout)
     print(f"\n# of `data.json` files found:     {len(datajson_paths)}")
-    song_paths = find_song_folders(CUSTOMSONG_DIR)
+    song_paths = find_song_folders(manifest)
     print(f"# of `song_[id].bin` files found: {len(song_paths)}")
 
     # Fetch metadata from spreadsheet
-    metadata_lists = load_metadata_from_gsheet(SHEET_NAME)  # Flattened keys
+    with stage("gsheet_download") as record:
+        metadata_lists = load_metadata_from_gsheet(SHEET_NAME)  # Flat keys
+        record.count(items=len(metadata_lists) - 1)
     metadata_dicts = csv_to_jsons(metadata_lists)           # Nested dicts
     print(f"# of spreadsheet rows loaded:     {len(metadata_dicts)}\n")
 
     # Import newly-added songs (e.g. TJAs) and fix them up
-    for song_id in (list(set(datajson_paths) - set(metadata_dicts))
-                    + []):
-        song_path = datajson_paths[song_id]
-        song_json = load_missing_datajson_metadata(song_path)
-        gunzip_files(song_path)
-        song_json['areFilesGZipped'] = False
-        song_json = fix_score(song_json, song_path)
-        song_path = fix_tja_parent_dirname(song_json, song_path)
-        update_volume(song_json, song_path)
-        metadata_dicts[song_id] = song_json
-        song_paths[song_id] = song_path
+    note_counts = load_note_counts()
+    import_songs(metadata_dicts, datajson_paths, song_paths, note_counts,
+                 args.jobs)
+    if args.rescore_all:
+        n_rescored = rescore_songs(metadata_dicts, datajson_paths, note_counts)
+        print(f"# of songs rescored:              {n_rescored}\n")
+    save_note_counts(note_counts)
 
     # Update metadata fields
-    metadata_dicts = update_order(metadata_dicts)  # Expects nested dicts
-    metadata_dicts = compute_difficulty(metadata_dicts)
-    metadata_dicts = fix_song_names(metadata_dicts)
+    metadata_dicts = update_metadata_fields(metadata_dicts, args,
+                                            datajson_paths)
+    if args.sync_volumes:
+        report_volume_syncs(sync_volumes(metadata_dicts, song_paths,
+                                         dry_run=args.dry_run,
+                                         max_workers=args.jobs),
+                            dry_run=args.dry_run)
     # TODO: Reimplement old features:
     #   1. Updating IDs using values from spreadsheet column
-    #   2. Fix overlapping UniqueID values
 
     # Write the metadata
-    print("Writing metadata to metadata.csv...")
-    write_csv(jsons_to_csv(metadata_dicts))        # Sanity check
-    print("Writing metadata to song data.json files...")
-    write_jsons(metadata_dicts, song_paths)        # Expects nested dicts
-    print(f"Uploading metadata to Google Sheet '{SHEET_NAME}'...")
-    write_metadata_to_gsheet(metadata_dicts, SHEET_NAME)
-    
+    write_metadata(metadata_dicts, song_paths, metadata_lists, manifest)
+    return metadata_dicts, note_counts
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if args.report:
+        RECORDER.start(trace_memory=args.report_memory)
+    try:
+        metadata_dicts, note_counts = sync_library(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+    if args.report:
+        RECORDER.write_report(args.report, args=vars(args))
+        print(f"Wrote stage report to {args.report}")
+
+    if args.watch:
+        try:
+            watch_library(args, metadata_dicts, note_counts)
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+
     # print("Metadata uploaded, launching taiko")
     # subprocess.call(['C:\\TaikoTDM\\Taiko no Tatsujin.exe'])
 
@@ -1,13 +1,13 @@
 """
 Python script to decrypt/un-gzip the `.bin` song files included in XB1/TDMX.
 
-Tested to work with files from v1.2.2 (check pins in #xb1_modding). May not
-work with newer versions with updated keys.
+Tested to work with files from v1.2.2 (check pins in #xb1_modding). Newer
+versions with updated keys can be supported by adding their keys to
+`KEY_VERSIONS`: the right key gets detected for each folder automatically.
 
 Prerequisites:
     1. Install Python.
-    2. Install a version of OpenSSL, making sure that `openssl` is on the PATH.
-       (In other words, make sure you can run `openssl` from the command line.)
+    2. Install the `cryptography` package (`pip install cryptography`).
 
 Instructions:
     1. Create a new empty folder.
@@ -16,8 +16,9 @@ Instructions:
         - You only need to copy the files that start with 'song_'
     3. Copy all the fumen subfolders to the new folder, too:
         - Location: 'TaikoTDM\Taiko no Tatsujin_Data\StreamingAssets\fumen'
-        - You don't need to organize the folders. This script will move each
-          'song_' file into each of the fumen subfolders once decrypted.
+        - You don't need to organize the folders. This script will hardlink
+          each 'song_' file into each of the fumen subfolders once decrypted.
+          (If your drive doesn't support hardlinks, they get moved instead.)
     4. Put this script in the same folder as the song files/fumen folders.
     5. Make sure the folder looks like this:
 
@@ -49,84 +50,224 @@ Instructions:
     6. Run the script
 """
 
-import gzip
+import contextlib
 import os
 import shutil
-import subprocess
-from subprocess import CalledProcessError
+import tempfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
-# Valid for TDMX v1.2.2
-KEYS = {
-    "fumen": "794A7A4E5651764C42484C625857364269476B337450414C46536665466D5746",
-    "song": "51795670785570353734733644547466445348384A4564367834645769357138"
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from bin_format import (classify_bytes, HEADER_SIZE, ENCRYPTED, GZIPPED,
+                        RAW_FUMEN, RAW_SONG)
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+AES_BLOCK_SIZE = 16
+# Enough plaintext to classify, i.e. `HEADER_SIZE` rounded up to whole blocks
+# (spotting a raw fumen takes its whole 520-byte header, not just the magic
+# bytes that give away songs and gzipped fumens)
+PROBE_SIZE = -(-HEADER_SIZE // AES_BLOCK_SIZE) * AES_BLOCK_SIZE
+
+DecryptResult = namedtuple("DecryptResult", ["path", "status", "message"])
+
+KEY_VERSIONS = {
+    "1.2.2": {
+        "fumen": ("794A7A4E5651764C42484C625857364269476B33"
+                  "7450414C46536665466D5746"),
+        "song": ("51795670785570353734733644547466445348384A456436"
+                 "7834645769357138"),
+    },
 }
 
+# (directory, filetype) -> key version that last worked there, so that files
+# from the same dump only get probed with the right key
+detected_versions = {}
 
-def is_decrypted(bytestring, filetype, fname):
-    # decrypted songs should start with @UTF marker
+
+def is_decrypted(head, filetype):
+    # decrypted songs should start with @UTF marker, while decrypted fumens
+    # should be gzipped (or, rarely, already raw)
+    kind = classify_bytes(head)
     if filetype == "song":
-        decrypted = bytestring.startswith(b"@UTF")
-    # decrypted fumens should contain the filename starting at byte 10
-    else:
-        assert filetype == "fumen"
-        decrypted = b".bin" in bytestring
-    return decrypted
+        return kind == RAW_SONG
+    assert filetype == "fumen"
+    return kind in (GZIPPED, RAW_FUMEN)
 
 
-def is_gunzipped(bytestring):
-    measure_seperator = b'\x00' + (b'\xFF' * 24) + b'\x00'
-    return measure_seperator in bytestring
+def read_chunks(f_in):
+    return iter(lambda: f_in.read(CHUNK_SIZE), b"")
 
 
-def decrypt_file(root, fname, filetype):
-    fpath = os.path.join(root, fname)
-    tmp_fpath = os.path.join(root, f"tempfile")
-    with open(fpath, "rb") as file:
-        bytestring = file.read()
-        iv_bytes = bytestring[:16].hex().upper()
-    if is_decrypted(bytestring, filetype, fname) or is_gunzipped(bytestring):
-        print(f"    {fname} has already been decrypted")
-        return False
-
-    command = (f"openssl aes-256-cbc -d -in {fpath} -out {tmp_fpath} "
-               f"-K {KEYS[filetype]} -iv {iv_bytes}")
+def probe_key(f_in, key, filetype):
+    # Decrypt just the header instead of the whole file
+    f_in.seek(0)
+    iv = f_in.read(AES_BLOCK_SIZE)
+    decryptor = Cipher(algorithms.AES(bytes.fromhex(key)),
+                       modes.CBC(iv)).decryptor()
+    return is_decrypted(decryptor.update(f_in.read(PROBE_SIZE)), filetype)
+
+
+def detect_key_version(f_in, root, filetype):
+    cached = detected_versions.get((root, filetype))
+    for version in sorted(KEY_VERSIONS, key=lambda v: v != cached):
+        if probe_key(f_in, KEY_VERSIONS[version][filetype], filetype):
+            detected_versions[(root, filetype)] = version
+            return version
+    return None
+
+
+def decrypt_chunks(f_in, key):
+    # Each file is laid out as `IV + ciphertext`, where the ciphertext is
+    # AES-256-CBC with PKCS#7 padding
+    iv = f_in.read(AES_BLOCK_SIZE)
+    decryptor = Cipher(algorithms.AES(bytes.fromhex(key)),
+                       modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    for chunk in read_chunks(f_in):
+        yield unpadder.update(decryptor.update(chunk))
+    yield unpadder.update(decryptor.finalize()) + unpadder.finalize()
+
+
+def gunzip_chunks(chunks):
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise zlib.error("truncated gzip stream")
+
+
+def peek_head(chunks):
+    # Pull just enough of the stream to classify it, then hand back an
+    # iterator that still yields every byte
+    chunks = iter(chunks)
+    buffered, n_buffered = [], 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        n_buffered += len(chunk)
+        if n_buffered >= HEADER_SIZE:
+            break
+    return b"".join(buffered)[:HEADER_SIZE], chain(buffered, chunks)
+
+
+def write_chunks(fpath, chunks):
+    # Written next to `fpath`, for `replace_file` to swap in, so a failure
+    # halfway through never leaves a truncated file (or the temp file) behind
+    root, fname = os.path.split(fpath)
+    fd, tmp_fpath = tempfile.mkstemp(dir=root, prefix=f"{fname}.",
+                                     suffix=".tmp")
     try:
-        subprocess.check_output(command, shell=True)
-    except CalledProcessError as e:
-        print(f"  - {fname} is invalid: {e}")
-        return False
-
-    with open(tmp_fpath, "rb") as file:
-        bytestring = file.read()
-    bytestring = bytestring[16:]  # discard iv bytes
-
-    if is_decrypted(bytestring, filetype, fname):
-        print(f"    Successfully decrypted {fname}")
-        with open(tmp_fpath, "wb") as file:
-            file.write(bytestring)
-        os.remove(fpath)
-        shutil.move(tmp_fpath, fpath)
-        return True
-    else:
-        print(f"    Couldn't find expected bytes in decrypted file")
-        os.remove(tmp_fpath)
-        return False
-
-
-def gunzip_file(root, fname):
+        with os.fdopen(fd, "wb") as f_out:
+            for chunk in chunks:
+                f_out.write(chunk)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_fpath)
+        raise
+    return tmp_fpath
+
+
+def replace_file(tmp_fpath, fpath):
+    try:
+        os.replace(tmp_fpath, fpath)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_fpath)
+        raise
+
+
+def process_file(root, fname, filetype):
+    # Decrypt -> gunzip -> write, as one stream, so the final file is the
+    # only thing ever written to disk
     fpath = os.path.join(root, fname)
-    tmp_fpath = os.path.join(root, "temp.bin")
+    steps = []
+    try:
+        with open(fpath, "rb") as f_in:
+            # Classify from the header alone, so files with nothing left to
+            # do never get streamed
+            kind = classify_bytes(f_in.read(HEADER_SIZE))
+            if kind not in (ENCRYPTED, GZIPPED):
+                return DecryptResult(fpath, "skipped",
+                                     f"already decrypted ({kind})")
+            f_in.seek(0)
+            chunks = read_chunks(f_in)
+            if kind == ENCRYPTED:
+                version = detect_key_version(f_in, root, filetype)
+                if version is None:
+                    return DecryptResult(fpath, "invalid",
+                                         "no known key decrypts this file "
+                                         f"(tried {', '.join(KEY_VERSIONS)})")
+                f_in.seek(0)
+                head, chunks = peek_head(decrypt_chunks(
+                    f_in, KEY_VERSIONS[version][filetype]))
+                if not is_decrypted(head, filetype):
+                    return DecryptResult(fpath, "invalid",
+                                         "couldn't find expected bytes in "
+                                         "decrypted file")
+                kind = classify_bytes(head)
+                steps.append(f"decrypted with v{version} key")
+            if kind == GZIPPED:
+                chunks = gunzip_chunks(chunks)
+                steps.append("gunzipped")
+            tmp_fpath = write_chunks(fpath, chunks)
+        # Only once `f_in` is closed, since Windows can't replace open files
+        replace_file(tmp_fpath, fpath)
+    except (ValueError, zlib.error) as e:  # bad padding, truncated data...
+        return DecryptResult(fpath, "invalid", str(e))
+    except OSError as e:  # e.g. disk full, file locked by another program
+        return DecryptResult(fpath, "failed", str(e))
+    status = "gunzipped" if steps == ["gunzipped"] else "decrypted"
+    return DecryptResult(fpath, status, " + ".join(steps))
+
+
+def process_fumen_folder(folder_path):
+    # Also catches fumens that were decrypted, but never gunzipped
+    return [process_file(root=folder_path, fname=fumen, filetype="fumen")
+            for fumen in sorted(f for f in os.listdir(folder_path)
+                                if f.endswith(".bin")
+                                and not f.startswith("song"))]
+
+
+def place_song(src, dest):
+    # Hardlink (or move) the song into its fumen folder rather than copying
+    # hundreds of MB of audio; copy only if the filesystem supports neither
+    if os.path.exists(dest):
+        if os.path.exists(src) and not os.path.samefile(src, dest):
+            os.remove(dest)
+        else:
+            return "already placed"
+    if not os.path.exists(src):
+        return None
+    try:
+        os.link(src, dest)
+        return "hardlinked"
+    except OSError:
+        pass
     try:
-        with gzip.open(fpath, 'rb') as f_in:
-            with open(tmp_fpath, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        print(f"    Successfully gunzipped {fname}")
-        os.remove(fpath)
-        shutil.move(tmp_fpath, fpath)
-        return True
-    except Exception as e:
-        print(f"    {fname} couldn't be gunzipped: {e}")
-        return False
+        os.replace(src, dest)
+        return "moved"
+    except OSError:
+        shutil.copy2(src, dest)
+        return "copied"
+
+
+def print_results(results):
+    for result in results:
+        message = f" ({result.message})" if result.message else ""
+        print(f"  - {result.status.upper():>9}: {result.path}{message}")
+    n_decrypted = sum(result.status == "decrypted" for result in results)
+    n_gunzipped = sum(result.status == "gunzipped" for result in results)
+    n_skipped = sum(result.status == "skipped" for result in results)
+    n_failed = sum(result.status == "failed" for result in results)
+    n_invalid = (len(results) - n_decrypted - n_gunzipped - n_skipped
+                 - n_failed)
+    print(f"  {n_decrypted} decrypted, {n_gunzipped} gunzipped, "
+          f"{n_skipped} already decrypted, {n_invalid} invalid, "
+          f"{n_failed} failed")
 
 
 def main():
@@ -138,32 +279,29 @@ def main():
     print(f"Found {len(folders)} fumen folders: {folders}")
     print(f"Found {len(bins)} song bins: {bins}")
 
-    print("\nDecrypting song bins...")
-    for song_bin in bins:
-        print(f"\n  - Decrypting {song_bin}...")
-        decrypt_file(root=SONG_DIR, fname=song_bin, filetype="song")
-
-    print("\nDecrypting + ungzipping fumen files...")
-    for folder_name in folders:
-        print(f"\n  - Decrypting + un-gzipping fumens in '{folder_name}/'...")
-        folder_path = os.path.join(SONG_DIR, folder_name)
-        for fumen in [f for f in os.listdir(folder_path)
-                      if f.endswith(".bin") and not f.startswith("song")]:
-            s = decrypt_file(root=folder_path, fname=fumen, filetype="fumen")
-            if s:
-                gunzip_file(root=folder_path, fname=fumen)
-
-    print("\nCopying song files to fumen folders...")
-    for folder_name in folders:  # Only copy files if its fumen folder exists
+    with ThreadPoolExecutor() as executor:
+        print("\nDecrypting song bins...")
+        print_results(list(executor.map(
+            lambda song_bin: process_file(root=SONG_DIR, fname=song_bin,
+                                          filetype="song"),
+            bins)))
+
+        print("\nDecrypting + ungzipping fumen files...")
+        folder_paths = [os.path.join(SONG_DIR, f) for f in folders]
+        print_results([result for results in
+                       executor.map(process_fumen_folder, folder_paths)
+                       for result in results])
+
+    print("\nPlacing song files in fumen folders...")
+    for folder_name in folders:  # Only place files if its fumen folder exists
         song_name = f"song_{folder_name}.bin"
         src = os.path.join(SONG_DIR, song_name)
-        folder_path = os.path.join(SONG_DIR, folder_name)
-        dest = os.path.join(folder_path, song_name)
-        if not os.path.exists(src):
+        dest = os.path.join(SONG_DIR, folder_name, song_name)
+        placed = place_song(src, dest)
+        if placed is None:
             print(f"  - Fumen folder {folder_name} missing song file")
         else:
-            print(f"  - Copying from {src} to {dest}")
-            shutil.copy(src, dest)
+            print(f"  - {placed.capitalize()}: {src} -> {dest}")
 
     input("Press Enter to continue...")
 
@@ -0,0 +1,201 @@
+"""
+Cell-level delta sync for Google Sheets worksheets.
+
+Instead of re-uploading a whole sheet, `sync_rows` compares the rows that
+are already in the sheet with the rows that should be there, and sends only
+what changed. Rows are matched up by their key column (e.g. the song ID),
+so that a song added to/removed from the middle of the sheet costs one
+inserted/deleted row, rather than shifting (and rewriting) every row below
+it. Cells that changed within matched rows get sent as one batched update,
+either as runs along a row (e.g. one song's edited fields) or down a column
+(e.g. the `order` column, which gets renumbered for a large share of the
+library whenever a song gets added or a score changes).
+
+Works with any object that has pygsheets' `Worksheet.insert_rows`,
+`delete_rows` and `update_values_batch` methods. The delta's cost is
+measured in cells (plus a few cells' worth of overhead per range/row op),
+and if it would be bigger than re-uploading the sheet is worth, `sync_rows`
+sends nothing and returns None, so that the caller can upload the whole
+sheet instead.
+"""
+
+from difflib import SequenceMatcher
+
+# Google rejects very large batch requests, so split them up
+MAX_RANGES_PER_REQUEST = 1000
+# Past this fraction of the sheet's cells (e.g. after re-sorting the whole
+# sheet), one full upload is cheaper
+MAX_CHANGED_FRACTION = 0.25
+# Rough overhead of each extra range/row op (A1 notation, request framing),
+# in cells. Column runs also bridge gaps of up to this many unchanged cells,
+# since rewriting those is cheaper than starting a new range.
+RANGE_COST_CELLS = 8
+
+
+def column_letter(col):
+    # 1 -> A, 26 -> Z, 27 -> AA, ...
+    letters = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def a1_range(row_start, col_start, row_end, col_end):
+    # 0-indexed, inclusive cell coordinates -> A1 notation
+    start = f"{column_letter(col_start + 1)}{row_start + 1}"
+    end = f"{column_letter(col_end + 1)}{row_end + 1}"
+    return start if start == end else f"{start}:{end}"
+
+
+def cell_value(rows, row_idx, col_idx):
+    # Cells missing from a row count as blank, so that rows/columns which no
+    # longer exist get cleared
+    row = rows[row_idx] if row_idx < len(rows) else []
+    return row[col_idx] if col_idx < len(row) else ""
+
+
+def changed_cells(old_rows, new_rows):
+    # {col: [rows]} of every cell that differs between the two (by position)
+    changed = {}
+    n_cols = max([len(r) for r in old_rows + new_rows], default=0)
+    for row_idx in range(max(len(old_rows), len(new_rows))):
+        for col_idx in range(n_cols):
+            old_val = cell_value(old_rows, row_idx, col_idx)
+            new_val = cell_value(new_rows, row_idx, col_idx)
+            if old_val != new_val or type(old_val) is not type(new_val):
+                changed.setdefault(col_idx, []).append(row_idx)
+    return changed
+
+
+def row_runs(changed):
+    # Runs of adjacent changed cells along each row
+    cols_by_row = {}
+    for col_idx, row_idxs in changed.items():
+        for row_idx in row_idxs:
+            cols_by_row.setdefault(row_idx, []).append(col_idx)
+    runs = []
+    for row_idx, col_idxs in cols_by_row.items():
+        col_idxs.sort()
+        run_start = col_idxs[0]
+        for prev_col, col_idx in zip(col_idxs, col_idxs[1:] + [None]):
+            if col_idx != prev_col + 1:
+                runs.append((row_idx, run_start, row_idx, prev_col))
+                run_start = col_idx
+    return runs
+
+
+def column_runs(changed, max_gap=RANGE_COST_CELLS):
+    # Runs of changed cells down each column (bridging short gaps), with any
+    # cell left on its own getting merged along its row instead
+    runs, singles = [], {}
+    for col_idx, row_idxs in changed.items():
+        run_start = prev_row = row_idxs[0]
+        for row_idx in row_idxs[1:] + [None]:
+            if row_idx is not None and row_idx - prev_row - 1 <= max_gap:
+                prev_row = row_idx
+                continue
+            if prev_row > run_start:
+                runs.append((run_start, col_idx, prev_row, col_idx))
+            else:
+                singles.setdefault(col_idx, []).append(run_start)
+            run_start = prev_row = row_idx
+    return runs + row_runs(singles)
+
+
+def ranges_cost(ranges):
+    return sum((row_end - row_start + 1) * (col_end - col_start + 1)
+               + RANGE_COST_CELLS
+               for row_start, col_start, row_end, col_end in ranges)
+
+
+def diff_rows(old_rows, new_rows):
+    # Returns the (row, col, 2D block of values) ranges that turn `old_rows`
+    # into `new_rows`, merging changed cells along rows or down columns,
+    # whichever is cheaper
+    changed = changed_cells(old_rows, new_rows)
+    if not changed:
+        return []
+    ranges = min(row_runs(changed), column_runs(changed), key=ranges_cost)
+    return [(row_start, col_start,
+             [[cell_value(new_rows, row_idx, col_idx)
+               for col_idx in range(col_start, col_end + 1)]
+              for row_idx in range(row_start, row_end + 1)])
+            for row_start, col_start, row_end, col_end in sorted(ranges)]
+
+
+def row_keys(rows, key_col):
+    return [row[key_col] if key_col < len(row) else "" for row in rows]
+
+
+def plan_row_ops(old_rows, new_rows, key_col=0):
+    # Matches the body rows (i.e. everything below the header) up by key,
+    # and returns the row inserts/deletes that turn the old rows into the
+    # new ones, plus the (positional) rows that the sheet will hold after
+    # those, for diffing cells against. Ops are listed bottom-up, so that
+    # each one's old row index is still valid when it gets applied.
+    #   ('insert', after_idx, [rows]) / ('delete', idx, n_rows)
+    matcher = SequenceMatcher(None, row_keys(old_rows[1:], key_col),
+                              row_keys(new_rows[1:], key_col),
+                              autojunk=False)
+    row_ops, aligned_rows = [], old_rows[:1]
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            aligned_rows.extend(old_rows[1 + i1:1 + i2])
+            continue
+        # Rows that only changed key (or got swapped around) keep their
+        # place in the sheet, and just get their cells rewritten
+        n_paired = min(i2 - i1, j2 - j1)
+        aligned_rows.extend(old_rows[1 + i1:1 + i1 + n_paired])
+        if i2 - i1 > n_paired:
+            row_ops.append(('delete', 1 + i1 + n_paired, i2 - i1 - n_paired))
+        if j2 - j1 > n_paired:
+            inserted = new_rows[1 + j1 + n_paired:1 + j2]
+            row_ops.append(('insert', i1 + n_paired, inserted))
+            aligned_rows.extend(inserted)
+    return row_ops[::-1], aligned_rows
+
+
+def send_row_ops(wks, row_ops):
+    # NB: pygsheets' row numbers are 1-indexed, and `insert_rows` inserts
+    # after the given row (so the header row's 1 inserts at the top)
+    for op, idx, arg in row_ops:
+        if op == 'insert':
+            wks.insert_rows(idx + 1, number=len(arg), values=arg)
+        else:
+            wks.delete_rows(idx + 1, number=arg)
+
+
+def send_changes(wks, changes):
+    for i in range(0, len(changes), MAX_RANGES_PER_REQUEST):
+        batch = changes[i:i + MAX_RANGES_PER_REQUEST]
+        ranges = [a1_range(row, col, row + len(block) - 1,
+                           col + len(block[0]) - 1)
+                  for row, col, block in batch]
+        values = [block for _, _, block in batch]
+        wks.update_values_batch(ranges, values, majordim='ROWS')
+
+
+def changes_cost(changes):
+    return sum(len(block) * len(block[0]) + RANGE_COST_CELLS
+               for _, _, block in changes)
+
+
+def sync_rows(wks, old_rows, new_rows, key_col=0,
+              max_changed_fraction=MAX_CHANGED_FRACTION):
+    # Returns the # of cells written, or None (having sent nothing) if the
+    # whole sheet should be re-uploaded instead
+    if not old_rows or not new_rows or old_rows[0] != new_rows[0]:
+        return None  # Can't match rows up without the same columns
+    row_ops, aligned_rows = plan_row_ops(old_rows, new_rows, key_col)
+    changes = diff_rows(aligned_rows, new_rows)
+    n_inserted_cells = sum(len(row) for op, _, rows in row_ops
+                           if op == 'insert' for row in rows)
+    cost = (n_inserted_cells + len(row_ops) * RANGE_COST_CELLS
+            + changes_cost(changes))
+    if cost > max_changed_fraction * len(new_rows) * len(new_rows[0]):
+        return None
+    send_row_ops(wks, row_ops)
+    send_changes(wks, changes)
+    return n_inserted_cells + sum(len(block) * len(block[0])
+                                  for _, _, block in changes)
@@ -0,0 +1,162 @@
+"""
+Per-stage timings/counters for `data.json_manager`.
+
+Code wraps each stage of a sync in `stage(name)`, and can attach counts to
+the record that it yields:
+
+    with stage("write_jsons") as record:
+        written = write_jsons(...)
+        record.count(items=len(written), bytes_written=n_bytes)
+
+Stages that run more than once (e.g. `scan`) get added up. Once `start()`
+has been called, every stage also records the process' peak RSS so far and,
+where the OS reports them (i.e. Linux), the bytes this process read/wrote
+while the stage ran, unless the stage counted its own bytes. Worker
+processes/TJAConvert.exe aren't included in either number.
+
+`start(trace_memory=True)` also records each stage's own peak memory via
+`tracemalloc`, but that makes allocation-heavy stages several times slower,
+so it's off by default, and the report says whether it was on.
+`write_report()` dumps everything as JSON, so that runs can be compared.
+"""
+
+import contextlib
+import datetime
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # e.g. on Windows
+    resource = None
+
+from utils import write_json_atomic
+
+REPORT_VERSION = 2
+
+
+def io_counters():
+    # (bytes read, bytes written) by this process so far, including cached
+    # reads, or None if the OS doesn't tell us
+    try:
+        with open("/proc/self/io", encoding="ascii") as fp:
+            fields = dict(line.split(": ") for line in fp.read().splitlines())
+    except (OSError, ValueError):
+        return None
+    return int(fields['rchar']), int(fields['wchar'])
+
+
+def max_rss():
+    # Peak resident set size of this process so far in bytes, or None if the
+    # OS doesn't tell us
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # Linux: KiB
+
+
+class StageRecord:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.bytes_read = None  # Only set if the stage counted them itself
+        self.bytes_written = None
+        self.io_read = None     # Process-wide I/O counters
+        self.io_written = None
+        self.peak_memory = None  # Only set if tracing memory
+        self.max_rss = None
+
+    def count(self, items=0, bytes_read=0, bytes_written=0):
+        self.items += items
+        if bytes_read:
+            self.bytes_read = (self.bytes_read or 0) + bytes_read
+        if bytes_written:
+            self.bytes_written = (self.bytes_written or 0) + bytes_written
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'seconds': round(self.seconds, 6),
+            'items': self.items,
+            'bytes_read': (self.bytes_read if self.bytes_read is not None
+                           else self.io_read),
+            'bytes_written': (self.bytes_written
+                              if self.bytes_written is not None
+                              else self.io_written),
+            'peak_memory': self.peak_memory,
+            'max_rss': self.max_rss,
+        }
+
+
+class Instrumentation:
+    def __init__(self):
+        self.stages = {}
+        self.enabled = False
+        self.started_at = None
+        self.start_time = None
+        self.trace_memory = False
+
+    def start(self, trace_memory=False):
+        # Also resets the records, e.g. between syncs in `--watch` mode
+        self.stages = {}
+        self.enabled = True
+        self.started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        self.start_time = time.perf_counter()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageRecord(name)
+        record = self.stages[name]
+        if not self.enabled:
+            yield record
+            return
+        trace_memory = tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        io_before = io_counters()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.calls += 1
+            record.seconds += time.perf_counter() - start
+            io_after = io_counters()
+            if io_before is not None and io_after is not None:
+                record.io_read = ((record.io_read or 0)
+                                  + io_after[0] - io_before[0])
+                record.io_written = ((record.io_written or 0)
+                                     + io_after[1] - io_before[1])
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - memory_before
+                record.peak_memory = max(record.peak_memory or 0, peak)
+            record.max_rss = max_rss()
+
+    def report(self, **extra):
+        return {
+            'version': REPORT_VERSION,
+            'started_at': self.started_at,
+            'seconds': (round(time.perf_counter() - self.start_time, 6)
+                        if self.start_time is not None else None),
+            'trace_memory': self.trace_memory,
+            **extra,
+            'stages': [record.to_dict() for record in self.stages.values()],
+        }
+
+    def write_report(self, report_path, **extra):
+        write_json_atomic(report_path, self.report(**extra), indent=2)
+
+
+# Shared by every module, so that stages don't need a recorder passed around
+RECORDER = Instrumentation()
+stage = RECORDER.stage
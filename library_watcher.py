@@ -0,0 +1,178 @@
+"""
+Change watcher for the customSongs folder (plus any extra files, e.g.
+TakoTako's `save.json`).
+
+On Linux, changes come from inotify (if the optional `inotify_simple`
+package is installed, e.g. with `pip install inotify_simple`). Everywhere else, the folder gets re-scanned with
+`scan_library` every few seconds, which only has to `stat` each directory.
+Either way, `LibraryWatcher.wait_for_changes()` waits until changes stop
+arriving for `debounce` seconds, so that e.g. copying a pack of 300 songs
+comes back as one batch of changed paths.
+
+Nothing that changes while a sync runs gets dropped, so a sync's own
+changes (written data.json files, renamed TJA folders, gunzipped fumens,
+TJAConvert.exe output, ...) come back as one more batch, whose sync finds
+nothing left to do. That costs a re-scan, but unlike ignoring them, it never
+loses a song that someone else added while the sync ran.
+"""
+
+import os
+import time
+
+from scan_manifest import scan_library, iter_dirs
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+def entry_state(entry):
+    # A manifest entry minus its scan times, which change every time a
+    # recently-modified (i.e. racy) folder gets re-scanned
+    if entry is None:
+        return None
+    state = {key: value for key, value in entry.items() if key != 'scanned'}
+    if state['datajson'] is not None:
+        state['datajson'] = {key: value
+                             for key, value in state['datajson'].items()
+                             if key != 'scanned'}
+    return state
+
+
+def is_temp_file(path):
+    # Written by our own atomic writes, and gone again a moment later
+    return path.endswith(".tmp")
+
+
+class PollingBackend:
+    name = "polling"
+
+    def __init__(self, root_dir, extra_files, interval=2.0):
+        self.root_dir = os.path.abspath(root_dir)
+        self.extra_files = extra_files
+        self.interval = interval
+        self.dirs = scan_library(self.root_dir)['dirs']
+        self.stats = {path: self.stat(path) for path in extra_files}
+
+    @staticmethod
+    def stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def check(self):
+        dirs = scan_library(self.root_dir)['dirs']
+        changed = {os.path.normpath(os.path.join(self.root_dir, rel_path))
+                   for rel_path in dirs.keys() | self.dirs.keys()
+                   if (entry_state(dirs.get(rel_path))
+                       != entry_state(self.dirs.get(rel_path)))}
+        self.dirs = dirs
+        for path in self.extra_files:
+            stat = self.stat(path)
+            if stat != self.stats[path]:
+                self.stats[path] = stat
+                changed.add(path)
+        return changed
+
+    def read(self, timeout=None):
+        # Blocks until something changes, or for up to `timeout` seconds
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.check()
+            if changed:
+                return changed
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+
+class InotifyBackend:
+    name = "inotify"
+
+    def __init__(self, root_dir, extra_files):
+        self.inotify = INotify()
+        self.mask = (flags.CREATE | flags.DELETE | flags.MODIFY
+                     | flags.CLOSE_WRITE | flags.MOVED_FROM | flags.MOVED_TO
+                     | flags.DELETE_SELF)
+        self.watch_dirs = {}  # watch descriptor -> dir path
+        for dir_path, _ in iter_dirs(scan_library(root_dir)):
+            self.add_watch(dir_path)
+        self.extra_files = extra_files
+        # Folders that are only watched for the sake of an extra file
+        self.file_only_wds = set()
+        for parent_dir in {os.path.dirname(path) for path in extra_files}:
+            if parent_dir not in self.watch_dirs.values():
+                wd = self.add_watch(parent_dir)
+                if wd is not None:
+                    self.file_only_wds.add(wd)
+
+    def add_watch(self, dir_path):
+        try:
+            wd = self.inotify.add_watch(dir_path, self.mask)
+        except OSError:  # e.g. the folder was deleted again right away
+            return None
+        self.watch_dirs[wd] = dir_path
+        return wd
+
+    def read(self, timeout=None):
+        timeout_ms = None if timeout is None else int(timeout * 1000)
+        changed = set()
+        for event in self.inotify.read(timeout=timeout_ms):
+            if event.mask & flags.IGNORED:
+                self.watch_dirs.pop(event.wd, None)
+                continue
+            dir_path = self.watch_dirs.get(event.wd)
+            if dir_path is None:
+                continue
+            path = (os.path.join(dir_path, event.name) if event.name
+                    else dir_path)
+            if event.wd in self.file_only_wds:
+                if path in self.extra_files:
+                    changed.add(path)
+                continue
+            if (event.mask & flags.ISDIR
+                    and event.mask & (flags.CREATE | flags.MOVED_TO)):
+                # inotify isn't recursive, so new folders (and anything
+                # copied into them already) need watches of their own
+                for new_dir, _, _ in os.walk(path):
+                    self.add_watch(new_dir)
+            if not is_temp_file(path):
+                changed.add(path)
+        return changed
+
+
+class LibraryWatcher:
+    def __init__(self, root_dir, extra_files=(), debounce=2.0, max_wait=60.0,
+                 poll_interval=2.0):
+        extra_files = [os.path.abspath(path) for path in extra_files]
+        if INotify is not None:
+            self.backend = InotifyBackend(root_dir, extra_files)
+        else:
+            self.backend = PollingBackend(root_dir, extra_files,
+                                          interval=poll_interval)
+        self.debounce = debounce
+        self.max_wait = max_wait
+
+    def wait_for_changes(self):
+        changes = set()
+        while not changes:
+            changes |= self.backend.read()
+        # Keep collecting until things go quiet (but don't wait forever if
+        # something keeps writing)
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            timeout = min(self.debounce, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            more_changes = self.backend.read(timeout)
+            if not more_changes:
+                break
+            changes |= more_changes
+        return changes
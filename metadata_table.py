@@ -0,0 +1,102 @@
+"""
+Columnar, typed store for the song metadata spreadsheet.
+
+Each column is a single NumPy array whose dtype comes from the column's type
+in the schema (e.g. `CSV_HEADERS`): int -> int64, float -> float64,
+bool -> bool, str -> object array of Python strings. Whole columns get
+coerced at once when loading sheet/CSV rows, instead of going through every
+cell in Python. Code that still wants a (nested) dict per song can get one
+from `row_json()`, or all of them from `to_jsons()`.
+"""
+
+import numpy as np
+
+from utils import flatten_dict, unflatten_dict
+
+DTYPES = {
+    int: np.int64,
+    float: np.float64,
+    bool: np.bool_,
+    str: object,
+}
+
+# Google Sheets and the CSV module hand booleans back as strings
+TRUE_STRINGS = ["True", "TRUE", "true"]
+
+
+def coerce_column(values, type_func):
+    values = np.asarray(values, dtype=object)
+    if type_func == bool:
+        is_true = values == True  # noqa: E712, elementwise comparison
+        for true_str in TRUE_STRINGS:
+            is_true |= values == true_str
+        return is_true.astype(np.bool_)
+    if type_func == str:
+        return values.astype(str).astype(object)
+    return values.astype(DTYPES[type_func])
+
+
+class MetadataTable:
+    def __init__(self, schema, columns):
+        self.schema = schema
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @classmethod
+    def from_rows(cls, rows, schema):
+        # `rows` is a header row followed by value rows, i.e. what comes
+        # back from the spreadsheet or from reading `metadata.csv`
+        header, *body = rows
+        value_columns = list(zip(*body)) if body else [()] * len(header)
+        columns = {}
+        for key, type_func in schema.items():
+            if key in header:
+                values = value_columns[header.index(key)]
+            else:
+                print(f"- WARNING: Metadata is missing column '{key}'")
+                values = [type_func()] * len(body)
+            columns[key] = coerce_column(values, type_func)
+        return cls(schema, columns)
+
+    @classmethod
+    def from_jsons(cls, jsons, schema):
+        flattened_jsons = [flatten_dict(json_dict)
+                           for json_dict in jsons.values()]
+        columns = {key: coerce_column([j[key] for j in flattened_jsons],
+                                      type_func)
+                   for key, type_func in schema.items()}
+        return cls(schema, columns)
+
+    def take(self, indices):
+        return MetadataTable(self.schema, {key: column[indices]
+                                           for key, column in
+                                           self.columns.items()})
+
+    def argsort(self, key, reverse=False):
+        # Stable, like `sorted()`, including when sorting in reverse
+        _, ranks = np.unique(self.columns[key], return_inverse=True)
+        return np.argsort(-ranks if reverse else ranks, kind='stable')
+
+    def to_rows(self):
+        value_columns = [self.columns[key].tolist() for key in self.schema]
+        return [list(self.schema.keys())] + [list(row) for row in
+                                             zip(*value_columns)]
+
+    def row_json(self, idx):
+        return unflatten_dict({key: column[idx:idx + 1].tolist()[0]
+                               for key, column in self.columns.items()})
+
+    def to_jsons(self):
+        # Builds every song's dict up front, on purpose: the sync edits them
+        # all in place (and writes back the ones that changed), so each one
+        # gets built anyway, and converting whole columns at once is cheaper
+        # than `row_json()` for every row
+        keys = list(self.schema.keys())
+        value_columns = [self.columns[key].tolist() for key in keys]
+        jsons = {}
+        for values in zip(*value_columns):
+            json_dict = unflatten_dict(dict(zip(keys, values)))
+            jsons[json_dict['id']] = json_dict
+        return jsons
@@ -0,0 +1,26 @@
+"""
+Persistent cache of the note counts that `fix_score` needs for each fumen.
+
+Parsing a fumen is the most expensive part of re-scoring a song, so counts
+are keyed by the fumen file's digest plus the drumroll duration they were
+computed with. Only charts whose bytes changed ever need to be parsed again.
+"""
+
+import os
+
+from utils import (__cache_dir__, file_digest, load_json_cache,
+                   write_json_atomic)
+
+NOTE_COUNT_CACHE_PATH = os.path.join(__cache_dir__, "note_counts.json")
+
+
+def load_note_counts(cache_path=NOTE_COUNT_CACHE_PATH):
+    return load_json_cache(cache_path) or {}
+
+
+def save_note_counts(note_counts, cache_path=NOTE_COUNT_CACHE_PATH):
+    write_json_atomic(cache_path, note_counts)
+
+
+def note_count_key(fumen_path, dur):
+    return f"{file_digest(fumen_path)}:{dur}"
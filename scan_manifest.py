@@ -0,0 +1,179 @@
+"""
+Single-pass scanner for the customSongs folder.
+
+The result of each scan is saved to an on-disk manifest, so that later runs
+only have to `stat` every directory. Directories whose mtime changed get
+re-listed, and `data.json` files whose size/mtime changed get re-read. Every
+other value (song id, song bin, fumen list, data.json digest) comes straight
+from the manifest.
+
+Like git's "racy clean" check, a record is only trusted if its mtime was
+older than the scan that took it by a couple of seconds; otherwise the
+file/folder could have been changed again within the same timestamp tick
+(e.g. FAT's 2 s one), so it gets re-read.
+"""
+
+import hashlib
+import os
+import re
+import time
+
+from utils import (__cache_dir__, parse_json_bytes, load_json_cache,
+                   write_json_atomic)
+
+MANIFEST_VERSION = 2
+# How close to its scan time an mtime has to be for the record to be racy
+RACY_WINDOW_NS = 2_000_000_000
+
+SONG_BIN_RE = re.compile(r"^song_(.+)\.bin$")
+FUMEN_BIN_RE = re.compile(r"^(.+)_([ehmnx])(_\d)?\.bin$")
+
+
+def manifest_path_for(root_dir):
+    # One manifest per scanned folder, so that scripts pointing at different
+    # folders don't keep invalidating each other's manifest
+    root_hash = hashlib.sha1(os.path.abspath(root_dir).encode("utf-8"))
+    return os.path.join(__cache_dir__,
+                        f"scan_manifest_{root_hash.hexdigest()[:8]}.json")
+
+
+def load_manifest(manifest_path):
+    return load_json_cache(manifest_path, MANIFEST_VERSION)
+
+
+def is_racy(record):
+    return record['mtime'] >= record['scanned'] - RACY_WINDOW_NS
+
+
+def record_matches(record, stat):
+    return (record is not None and not is_racy(record)
+            and record['size'] == stat.st_size
+            and record['mtime'] == stat.st_mtime_ns)
+
+
+def read_datajson_record(dir_path, old_record=None):
+    json_path = os.path.join(dir_path, "data.json")
+    try:
+        stat = os.stat(json_path)
+    except OSError:
+        return None
+    if record_matches(old_record, stat):
+        return old_record
+    scanned = time.time_ns()
+    with open(json_path, "rb") as fp:
+        bytestring = fp.read()
+    try:
+        song_id = parse_json_bytes(bytestring)['id']
+    except Exception:  # noqa, e.g. if data.json is empty
+        song_id = None
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'digest': hashlib.sha1(bytestring).hexdigest(),
+        'id': song_id,
+        'scanned': scanned,
+    }
+
+
+def scan_dir(dir_path, dir_mtime, old_entry=None):
+    scanned = time.time_ns()
+    subdirs, files = [], []
+    with os.scandir(dir_path) as it:
+        for dir_entry in it:
+            if dir_entry.is_dir():
+                subdirs.append(dir_entry.name)
+            else:
+                files.append(dir_entry.name)
+
+    song_bin, fumens, has_tja = None, [], False
+    for file_name in sorted(files):
+        match = SONG_BIN_RE.match(file_name)
+        if match:
+            if song_bin is None:
+                song_bin = match.group(1)
+        elif FUMEN_BIN_RE.match(file_name):
+            fumens.append(file_name)
+        elif file_name.endswith(".tja"):
+            has_tja = True
+
+    datajson = None
+    if "data.json" in files:
+        old_record = old_entry['datajson'] if old_entry else None
+        datajson = read_datajson_record(dir_path, old_record)
+
+    return {
+        'mtime': dir_mtime,
+        'subdirs': sorted(subdirs),
+        'tja': has_tja,
+        'song_bin': song_bin,
+        'fumens': fumens,
+        'datajson': datajson,
+        'scanned': scanned,
+    }
+
+
+def scan_library(root_dir, manifest_path=None):
+    if manifest_path is None:
+        manifest_path = manifest_path_for(root_dir)
+    old_manifest = load_manifest(manifest_path)
+    old_dirs = old_manifest['dirs'] if old_manifest else {}
+
+    # Depth-first walk in sorted order, keyed by paths relative to root_dir
+    new_dirs = {}
+    pending = [os.curdir]
+    while pending:
+        rel_path = pending.pop()
+        dir_path = os.path.join(root_dir, rel_path)
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            continue
+        entry = old_dirs.get(rel_path)
+        if entry is None or entry['mtime'] != dir_mtime or is_racy(entry):
+            entry = scan_dir(dir_path, dir_mtime, entry)
+        elif entry['datajson'] is not None:
+            # Editing a file in place doesn't touch its folder's mtime
+            entry = dict(entry, datajson=read_datajson_record(
+                dir_path, entry['datajson']))
+        new_dirs[rel_path] = entry
+        pending.extend(os.path.normpath(os.path.join(rel_path, d))
+                       for d in reversed(entry['subdirs']))
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'root': os.path.abspath(root_dir),
+        'dirs': new_dirs,
+    }
+    if old_manifest != manifest:
+        write_json_atomic(manifest_path, manifest, ensure_ascii=False)
+    return manifest
+
+
+def iter_dirs(manifest):
+    root_dir = manifest['root']
+    for rel_path, entry in manifest['dirs'].items():
+        if rel_path == os.curdir:
+            yield root_dir, entry
+        else:
+            yield os.path.join(root_dir, rel_path), entry
+
+
+def datajson_records(manifest):
+    return {root: entry['datajson'] for root, entry in iter_dirs(manifest)
+            if entry['datajson'] is not None}
+
+
+def file_matches(filepath, bytestring, record=None):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return False
+    if stat.st_size != len(bytestring):
+        return False
+    # Trust the manifest's digest as long as the file hasn't been touched
+    # since it was scanned (and wasn't racy then); otherwise fall back to
+    # comparing the bytes
+    if record_matches(record, stat):
+        return record['digest'] == hashlib.sha1(bytestring).hexdigest()
+    with open(filepath, "rb") as fp:
+        return fp.read() == bytestring
@@ -0,0 +1,210 @@
+"""
+Importing newly-added songs (e.g. freshly-converted TJAs) into the metadata.
+
+`import_new_songs` imports each song on a process pool: it reads the
+song's data.json, scores its fumens, renames converted TJAs' folders after
+their song and writes the song's volume. Everything that runs in the
+worker processes lives in this module (rather than in `data.json_manager`,
+whose filename can't be imported), so that workers can import it when
+they're started with "spawn", i.e. on Windows/macOS.
+"""
+
+import os
+import math
+import traceback
+from collections import ChainMap, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import read_json, flatten_dict, unflatten_dict
+from note_count_cache import note_count_key
+from song_volume import sync_volume
+
+
+def count_notes(fumen, dur):
+    n_notes = 0
+    n_balloon = 0
+    n_drumroll = 0
+    for measure in fumen.measures:
+        if measure.branches['master'].length:
+            branch = measure.branches['master']
+        else:
+            branch = measure.branches['normal']
+        for note in branch.notes:
+            if (note.note_type.lower().startswith('don') or
+                    note.note_type.lower().startswith('ka')):
+                n_notes += 1
+            elif note.note_type.lower() == 'balloon':
+                if note.hits >= 2 * (note.duration / dur) and note.hits > 15:
+                    # print(f"Troll balloon notes identified: {note.hits}")
+                    n_balloon += 2 * math.ceil(note.duration / dur)
+                else:
+                    n_balloon += note.hits
+            elif note.note_type.lower() == 'kusudama':
+                if note.hits >= 2 * (note.duration / dur) and note.hits > 15:
+                    # print(f"Troll kusudama notes identified: {note.hits}")
+                    n_balloon += 2 * math.ceil(note.duration / dur)
+                else:
+                    n_balloon += note.hits
+            elif note.note_type.lower() == 'drumroll':
+                n_drumroll += math.ceil(note.duration / dur)
+            else:
+                continue
+    return n_notes, n_balloon, n_drumroll
+
+
+def fumen_note_counts(fumen_path, dur, note_counts=None):
+    from tja2fumen import parse_fumen
+    if note_counts is None:
+        return count_notes(parse_fumen(fumen_path), dur)
+    key = note_count_key(fumen_path, dur)
+    if key not in note_counts:
+        note_counts[key] = list(count_notes(parse_fumen(fumen_path), dur))
+    return tuple(note_counts[key])
+
+
+def fix_score(json_dict, song_path, note_counts=None):
+    difficulites = [("Easy", "e", 150),
+                    ("Normal", "n", 125),
+                    ("Hard", "h", 100),
+                    ("Mania", "m", 80),
+                    ("Ura", "x", 80)]
+    for (diff_name, diff_suffix, dur) in difficulites:
+        if json_dict[f"star{diff_name}"] == 0:
+            json_dict[f'score{diff_name}'] = 0
+            json_dict[f'shinuti{diff_name}'] = 0
+            continue
+        # fetch song data from .bin files
+        song_id = json_dict['id']
+        fname_fumen = f"{song_id}_{diff_suffix}.bin"
+        n_notes, n_hits, n_drumrolls = fumen_note_counts(
+            os.path.join(song_path, fname_fumen), dur, note_counts)
+        # estimate a new value for the points per good
+        good_points_estimated = ((1000000 - ((n_hits + n_drumrolls) * 100))
+                                 / n_notes)
+        good_points_estimated_rounded = math.ceil(good_points_estimated
+                                                  / 10.0) * 10
+        top_score_estimated = ((good_points_estimated_rounded * n_notes)
+                               + (n_hits * 100) + (n_drumrolls * 100))
+
+        json_dict[f'score{diff_name}'] = top_score_estimated
+        json_dict[f'shinuti{diff_name}'] = good_points_estimated_rounded
+
+    return json_dict
+
+
+def load_missing_datajson_metadata(root, schema):
+    # Load values generated by TakoTako (`schema` being `CSV_HEADERS`)
+    json_path = os.path.join(root, "data.json")
+    json_dict = flatten_dict(read_json(json_path))
+    # Add default values if missing
+    json_dict = {key: type_func(json_dict[key]) if key in json_dict
+                 else type_func()
+                 for key, type_func in schema.items()}
+    json_dict = unflatten_dict(json_dict)
+    # Fix TakoTako's buggy fumenOffsetPos (`{0, 2000} - offset`)
+    old_offset = json_dict['fumenOffsetPos']
+    json_dict['fumenOffsetPos'] = 0 if old_offset <= 0 else 2000
+    # Set default values for fields with nonzero defaults
+    json_dict['volume'] = 1.0
+    json_dict['starMax'] = max(
+        json_dict['starEasy'],
+        json_dict['starNormal'],
+        json_dict['starHard'],
+        json_dict['starMania'],
+        json_dict['starUra']
+    )
+    json_dict['date'] = '2088-08-08'
+    json_dict['songName']['font'] = "1"
+    print(f"- Imported {json_dict['songName']['text']} "
+          f"({json_dict['songSubtitle']['text']})")
+    return json_dict
+
+
+def update_volume(json_dict, par_dir):
+    song_id = json_dict['id']
+    result = sync_volume(song_id, par_dir, json_dict['volume'])
+    if result.status in ("missing", "too short"):
+        raise ValueError(f"Can't write volume to {result.path} "
+                         f"({result.status})")
+    if result.status == "patched":
+        print(f"Writing {result.new_volume} for {song_id}.")
+
+
+def safe_filename(string):
+    return "".join(c for c in string
+                   if c.isalpha() or c.isdigit() or c == ' ').rstrip()
+
+
+def fix_tja_parent_dirname(song_json, song_path):
+    is_tja = song_json['tjaFileHash'] != '0'
+    if not is_tja or "[GENERATED]" not in song_path:
+        return song_path
+    gen_dir = os.path.basename(song_path)
+    parent_dir = os.path.abspath(os.path.join(song_path, '..'))
+    song_name = song_json['songName']['text']
+    new_name = safe_filename(song_name)
+    new_dir = os.path.join(
+        os.path.abspath(os.path.join(parent_dir, '..')),
+        new_name
+    )
+    if new_dir != parent_dir:
+        os.rename(parent_dir, new_dir)
+    song_path_new = os.path.join(new_dir, gen_dir)
+    return song_path_new
+
+
+ImportResult = namedtuple("ImportResult", ["song_id", "song_json",
+                                           "song_path", "note_counts",
+                                           "error"])
+
+# Read-only copy of the note count cache (plus the metadata schema), set
+# once per worker process
+_worker_note_counts = {}
+_worker_schema = {}
+
+
+def init_import_worker(note_counts, schema):
+    global _worker_note_counts, _worker_schema
+    _worker_note_counts = note_counts
+    _worker_schema = schema
+
+
+def import_song(song_id, song_path):
+    # Any counts computed here land in `new_counts`, so that only those have
+    # to be sent back to the parent process
+    new_counts = {}
+    note_counts = ChainMap(new_counts, _worker_note_counts)
+    try:
+        # NB: The song's files have already been gunzipped by the caller
+        song_json = load_missing_datajson_metadata(song_path,
+                                                   _worker_schema)
+        song_json['areFilesGZipped'] = False
+        song_json = fix_score(song_json, song_path, note_counts)
+        song_path = fix_tja_parent_dirname(song_json, song_path)
+        update_volume(song_json, song_path)
+    except Exception:  # noqa, one broken song shouldn't stop the import
+        return ImportResult(song_id, None, song_path, new_counts,
+                            traceback.format_exc())
+    return ImportResult(song_id, song_json, song_path, new_counts, None)
+
+
+def import_new_songs(song_ids, datajson_paths, note_counts, schema,
+                     max_workers=None, mp_context=None):
+    song_ids = sorted(song_ids)
+    if not song_ids:
+        return []
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                             initializer=init_import_worker,
+                             initargs=(note_counts, schema)) as executor:
+        futures = [executor.submit(import_song, song_id,
+                                   datajson_paths[song_id])
+                   for song_id in song_ids]
+        results = []
+        for song_id, future in zip(song_ids, futures):
+            try:
+                results.append(future.result())
+            except Exception:  # noqa, e.g. if the worker process died
+                results.append(ImportResult(song_id, None,
+                                            datajson_paths[song_id], {},
+                                            traceback.format_exc()))
+    return results
@@ -0,0 +1,136 @@
+"""
+Sort-key building and ordering engine for `update_order`.
+
+Instead of calling a key function per song (which looks up scores, parses
+dates and normalises titles every time it's called), every sort key is
+built once for the whole library as a NumPy column, and songs are then
+ordered with a single `np.lexsort`. Normalised titles are cached on disk,
+since they only change when a title does.
+"""
+
+import os
+import unicodedata
+
+import numpy as np
+
+from utils import __cache_dir__, load_json_cache, write_json_atomic
+
+TITLE_CACHE_PATH = os.path.join(__cache_dir__, "normalized_titles.json")
+
+
+def strip_accents(s):
+    return ''.join(c for c in unicodedata.normalize('NFD', s)
+                   if unicodedata.category(c) != 'Mn')
+
+
+def load_title_cache(cache_path=TITLE_CACHE_PATH):
+    return load_json_cache(cache_path) or {}
+
+
+def save_title_cache(title_cache, cache_path=TITLE_CACHE_PATH):
+    write_json_atomic(cache_path, title_cache, ensure_ascii=False)
+
+
+def normalize_titles(titles, title_cache):
+    normalized = []
+    for title in titles:
+        if title not in title_cache:
+            title_cache[title] = strip_accents(title).upper()
+        normalized.append(title_cache[title])
+    return np.array(normalized, dtype=object)
+
+
+def string_ranks(strings):
+    # Replace strings with their rank in sorted order, so that every key
+    # handed to `np.lexsort` is a plain integer array. (Fixed-width unicode
+    # arrays sort by code point like Python does, but without calling back
+    # into Python for every comparison.)
+    _, ranks = np.unique(np.asarray(strings, dtype=str), return_inverse=True)
+    return ranks.reshape(-1)
+
+
+def score_column(song_ids, scores):
+    return np.fromiter((scores.get(song_id, 0) for song_id in song_ids),
+                       dtype=np.int64, count=len(song_ids))
+
+
+def date_ordinals(dates):
+    # Newest first. Dates that aren't digits once the dashes are gone (e.g.
+    # blank, or "????") count as 0, i.e. sort after every real date
+    digits = np.char.replace(np.asarray(dates, dtype=str), '-', '')
+    is_number = np.char.isdigit(digits)
+    numbers = np.zeros(len(digits), dtype=np.int64)
+    numbers[is_number] = digits[is_number].astype(np.int64)
+    return 99999999 - numbers
+
+
+def build_sort_keys(jsons, entries=None, title_cache=None):
+    if title_cache is None:
+        title_cache = {}
+    songs = list(jsons.values())
+    song_ids = [j['id'] for j in songs]
+    titles = np.array([j['songName']['text'] for j in songs], dtype=object)
+    keys = {
+        'genre': np.array([j['genreNo'] for j in songs], dtype=np.int64),
+        'star_max': np.array([j['starMax'] for j in songs], dtype=np.int64),
+        'star_mania': np.array([j['starMania'] for j in songs],
+                               dtype=np.int64),
+        'star_ura': np.array([j['starUra'] for j in songs], dtype=np.int64),
+        'title': titles,
+        'title_normalized': normalize_titles(titles, title_cache),
+        'date_ordinal': date_ordinals([j['date'] for j in songs]),
+        'debut': np.array([j['debut'] for j in songs], dtype=object),
+    }
+    if entries is not None:
+        scores = {song_id: int(entry['Score'])
+                  for song_id, entry in entries.items() if entry['Score']}
+        keys['score_omote'] = score_column(song_ids, scores)
+        keys['score_ura'] = score_column([f"{s}_ura" for s in song_ids],
+                                         scores)
+    return keys
+
+
+def genre_star_order(keys):
+    return np.lexsort((
+        string_ranks(keys['title_normalized']),
+        10 - keys['star_max'],
+        keys['genre'],
+    ))
+
+
+def score_order(keys):
+    # Songs with a score come first (hardest/best-scored first), followed by
+    # unplayed songs (newest first)
+    score_omote, score_ura = keys['score_omote'], keys['score_ura']
+    has_score = (score_omote > 0) | (score_ura > 0)
+    score_sort = np.where(score_ura > 0, score_ura, score_omote)
+    star_sort = np.where(score_ura > 0, keys['star_ura'],
+                         np.where(score_omote > 0, keys['star_mania'],
+                                  np.maximum(keys['star_mania'],
+                                             keys['star_ura'])))
+    # Played and unplayed songs never get compared with each other, so each
+    # group can use different keys in the same position
+    titles = np.where(has_score, keys['title'], keys['title_normalized'])
+    return np.lexsort((
+        string_ranks(titles),
+        np.where(has_score, 1_000_000 - score_sort,
+                 string_ranks(keys['debut'])),
+        np.where(has_score, 10 - star_sort, keys['date_ordinal']),
+        keys['genre'],
+        np.where(has_score, 1, 2),
+    ))
+
+
+def date_order(keys):
+    return np.lexsort((
+        string_ranks(keys['title_normalized']),
+        string_ranks(keys['debut']),
+        keys['date_ordinal'],
+    ))
+
+
+ORDER_MODES = {
+    'score': score_order,
+    'genre-star': genre_star_order,
+    'date': date_order,
+}
@@ -0,0 +1,68 @@
+"""
+Read/patch the playback volume stored in `song_[id].bin` files.
+
+The volume is a big-endian float at offset `0x217`. Only the first few
+hundred bytes of each file get mapped into memory, so checking a whole
+library never reads the audio data itself, and files whose stored volume
+already matches the `volume` column are left untouched.
+"""
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+VOLUME_OFFSET = 0x217
+VOLUME_FORMAT = ">f"
+VOLUME_END = VOLUME_OFFSET + struct.calcsize(VOLUME_FORMAT)
+
+VolumeResult = namedtuple("VolumeResult", ["song_id", "path", "old_volume",
+                                           "new_volume", "status"])
+
+
+def target_volume(volume):
+    # A volume of 0 in the metadata means "leave it at the default"
+    return 1.0 if volume == 0 else volume
+
+
+def song_bin_path(song_dir, song_id):
+    return os.path.join(song_dir, f"song_{song_id}.bin")
+
+
+def sync_volume(song_id, song_dir, volume, dry_run=False):
+    song_path = song_bin_path(song_dir, song_id)
+    new_volume = target_volume(volume)
+    # Compare the packed bytes, so that e.g. 0.1 (a double) matches the
+    # float32 that's stored in the file
+    new_bytes = struct.pack(VOLUME_FORMAT, new_volume)
+    try:
+        with open(song_path, "rb" if dry_run else "rb+") as fp:
+            if os.fstat(fp.fileno()).st_size < VOLUME_END:
+                return VolumeResult(song_id, song_path, None, new_volume,
+                                    "too short")
+            access = mmap.ACCESS_READ if dry_run else mmap.ACCESS_WRITE
+            with mmap.mmap(fp.fileno(), VOLUME_END, access=access) as mm:
+                old_bytes = mm[VOLUME_OFFSET:VOLUME_END]
+                old_volume, = struct.unpack(VOLUME_FORMAT, old_bytes)
+                if old_bytes == new_bytes:
+                    return VolumeResult(song_id, song_path, old_volume,
+                                        new_volume, "ok")
+                if dry_run:
+                    return VolumeResult(song_id, song_path, old_volume,
+                                        new_volume, "mismatch")
+                mm[VOLUME_OFFSET:VOLUME_END] = new_bytes
+                mm.flush()
+    except FileNotFoundError:
+        return VolumeResult(song_id, song_path, None, new_volume, "missing")
+    return VolumeResult(song_id, song_path, old_volume, new_volume, "patched")
+
+
+def sync_volumes(jsons, song_paths, dry_run=False, max_workers=None):
+    song_ids = [song_id for song_id in jsons if song_id in song_paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda song_id: sync_volume(song_id, song_paths[song_id],
+                                        jsons[song_id]['volume'],
+                                        dry_run=dry_run),
+            song_ids))
@@ -0,0 +1,11 @@
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+# The scripts live at the top level of the repo (not in a package), and the
+# fakes for pygsheets/TJAConvert.exe live with the benchmarks
+for path in [REPO_DIR, os.path.join(REPO_DIR, "benchmarks")]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
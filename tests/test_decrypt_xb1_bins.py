@@ -0,0 +1,81 @@
+import gzip
+import os
+import struct
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives import padding  # noqa: E402
+from cryptography.hazmat.primitives.ciphers import (  # noqa: E402
+    Cipher, algorithms, modes)
+
+import decrypt_xb1_bins  # noqa: E402
+from decrypt_xb1_bins import AES_BLOCK_SIZE, process_file  # noqa: E402
+
+FUMEN_BYTES = os.urandom(4096)
+
+
+def write_gzipped_fumen(tmp_path):
+    with open(tmp_path / "song_m.bin", "wb") as fp:
+        fp.write(gzip.compress(FUMEN_BYTES))
+
+
+def test_gunzips_fumen(tmp_path):
+    write_gzipped_fumen(tmp_path)
+    result = process_file(str(tmp_path), "song_m.bin", "fumen")
+    assert result.status == "gunzipped"
+    assert (tmp_path / "song_m.bin").read_bytes() == FUMEN_BYTES
+
+
+def test_os_error_is_a_failed_result(tmp_path, monkeypatch):
+    def replace(src, dst):
+        raise OSError(28, "No space left on device")
+
+    write_gzipped_fumen(tmp_path)
+    monkeypatch.setattr(decrypt_xb1_bins.os, "replace", replace)
+    result = process_file(str(tmp_path), "song_m.bin", "fumen")
+    assert result.status == "failed"
+    assert "No space left on device" in result.message
+    # The original is untouched, and the temp file is gone
+    assert os.listdir(tmp_path) == ["song_m.bin"]
+    fumen_bytes = gzip.decompress((tmp_path / "song_m.bin").read_bytes())
+    assert fumen_bytes == FUMEN_BYTES
+
+
+def test_missing_file_is_a_failed_result(tmp_path):
+    result = process_file(str(tmp_path), "song_m.bin", "fumen")
+    assert result.status == "failed"
+
+
+def encrypt(data, key):
+    iv = os.urandom(AES_BLOCK_SIZE)
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    encryptor = Cipher(algorithms.AES(bytes.fromhex(key)),
+                       modes.CBC(iv)).encryptor()
+    padded = padder.update(data) + padder.finalize()
+    return iv + encryptor.update(padded) + encryptor.finalize()
+
+
+def test_decrypts_raw_fumen(tmp_path):
+    # Timing windows, no branches, 1 measure: a fumen that was never gzipped
+    fumen_bytes = (struct.pack("<fff", 25.0, 75.0, 108.0) + bytes(420)
+                   + struct.pack("<i", 0) + bytes(76) + struct.pack("<I", 1)
+                   + os.urandom(1000))
+    key = decrypt_xb1_bins.KEY_VERSIONS["1.2.2"]["fumen"]
+    with open(tmp_path / "song_m.bin", "wb") as fp:
+        fp.write(encrypt(fumen_bytes, key))
+    result = process_file(str(tmp_path), "song_m.bin", "fumen")
+    assert result.status == "decrypted"
+    assert (tmp_path / "song_m.bin").read_bytes() == fumen_bytes
+
+
+def test_skipped_file_is_only_classified(tmp_path, monkeypatch):
+    def read_chunks(f_in):
+        raise AssertionError("an already decrypted file got streamed")
+
+    with open(tmp_path / "song_x.bin", "wb") as fp:
+        fp.write(b"@UTF" + os.urandom(4096))
+    monkeypatch.setattr(decrypt_xb1_bins, "read_chunks", read_chunks)
+    result = process_file(str(tmp_path), "song_x.bin", "song")
+    assert result.status == "skipped"
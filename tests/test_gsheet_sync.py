@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from fake_pygsheets import FakeWorksheet
+from gsheet_sync import sync_rows
+
+HEADER = ["id", "title", "date"]
+
+
+def make_rows(n_rows):
+    return [HEADER] + [[f"song{i:05d}", f"Title {i}", f"2024-01-{i % 28:02d}"]
+                       for i in range(n_rows)]
+
+
+def check_sync(old_rows, new_rows):
+    wks = FakeWorksheet(old_rows)
+    n_cells = sync_rows(wks, old_rows, new_rows)
+    assert n_cells is not None
+    assert wks.rows == new_rows
+    return wks, n_cells
+
+
+def test_insert_at_top_is_one_row_insert():
+    old_rows = make_rows(1000)
+    new_rows = [HEADER, ["new", "New song", "2088-08-08"]] + old_rows[1:]
+    wks, n_cells = check_sync(old_rows, new_rows)
+    # One `insert_rows` call (plus the values pygsheets sends with it)
+    assert wks.n_requests == 2
+    assert n_cells == len(HEADER)
+
+
+def test_delete_and_edit():
+    old_rows = make_rows(1000)
+    new_rows = [list(row) for row in old_rows]
+    del new_rows[500]
+    new_rows[10][1] = "Renamed"
+    new_rows[900][2] = "2020-02-02"
+    wks, n_cells = check_sync(old_rows, new_rows)
+    assert wks.n_requests == 2  # One `delete_rows`, one batch of cells
+    assert n_cells == 2
+
+
+def test_random_edits_match_new_rows():
+    rng = random.Random(0)
+    old_rows = make_rows(500)
+    new_rows = [list(row) for row in old_rows]
+    for i in range(20):
+        idx = rng.randrange(1, len(new_rows))
+        action = rng.choice(["insert", "delete", "edit"])
+        if action == "insert":
+            new_rows.insert(idx, [f"new{i}", f"New {i}", "2088-08-08"])
+        elif action == "delete":
+            del new_rows[idx]
+        else:
+            new_rows[idx][1] += " (edited)"
+    check_sync(old_rows, new_rows)
+
+
+def test_insert_with_shifted_order_column():
+    # Adding a song renumbers `order` for every song that sorts after it,
+    # which (in a sheet sorted by date) are scattered all over the sheet
+    rng = random.Random(0)
+    header = HEADER + ["order"]
+    orders = list(range(2000))
+    rng.shuffle(orders)
+    old_rows = [header] + [row + [order] for row, order
+                           in zip(make_rows(2000)[1:], orders)]
+    new_order = 1400
+    new_rows = [header, ["new", "New song", "2088-08-08", new_order]]
+    new_rows += [row[:3] + [row[3] + (row[3] >= new_order)]
+                 for row in old_rows[1:]]
+    wks, n_cells = check_sync(old_rows, new_rows)
+    # The row insert, plus one batch with the shifted `order` cells going
+    # out as (about) one column range, rather than ~600 single-cell ranges
+    assert wks.n_requests == 3
+    assert n_cells <= len(header) + len(new_rows)
+
+
+@pytest.mark.parametrize("new_rows", [
+    [HEADER] + make_rows(1000)[:0:-1],          # Whole sheet re-sorted
+    [["id", "title"]] + make_rows(1000)[1:],    # Columns changed
+])
+def test_falls_back_to_full_upload(new_rows):
+    old_rows = make_rows(1000)
+    wks = FakeWorksheet(old_rows)
+    assert sync_rows(wks, old_rows, new_rows) is None
+    assert wks.n_requests == 0
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import library_watcher
+import scan_manifest
+from library_watcher import LibraryWatcher
+from utils import write_bytes_atomic
+
+BACKENDS = ["polling"] + (["inotify"] if library_watcher.INotify else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def make_watcher(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(scan_manifest, "__cache_dir__",
+                        str(tmp_path / "cache"))
+    if request.param == "polling":
+        monkeypatch.setattr(library_watcher, "INotify", None)
+
+    def make(root_dir, extra_files=()):
+        watcher = LibraryWatcher(root_dir, extra_files, debounce=0.2,
+                                 poll_interval=0.05)
+        assert watcher.backend.name == request.param
+        return watcher
+    return make
+
+
+def write_file(path, data=b""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        fp.write(data)
+
+
+def fake_sync(root_dir):
+    # The same kinds of changes a sync makes to the library: TJAConvert.exe
+    # output, renaming the converted song's folder, gunzipping a fumen in
+    # place and (atomically) rewriting data.json files
+    tja_dir = os.path.join(root_dir, "pack", "new song")
+    gen_dir = os.path.join(tja_dir, "new song [GENERATED]")
+    write_file(os.path.join(gen_dir, "data.json"), b'{"id": "new"}')
+    write_file(os.path.join(gen_dir, "song_new.bin"))
+    renamed_dir = os.path.join(root_dir, "pack", "New Song")
+    os.rename(tja_dir, renamed_dir)
+    write_file(os.path.join(root_dir, "old", "old_m.bin"), b"gunzipped")
+    for song_dir in [os.path.join(root_dir, "old"),
+                     os.path.join(renamed_dir, "new song [GENERATED]")]:
+        write_bytes_atomic(os.path.join(song_dir, "data.json"),
+                           b'{"id": "rewritten"}')
+
+
+def test_sync_triggers_at_most_one_more_batch(tmp_path, make_watcher):
+    root_dir = str(tmp_path / "customSongs")
+    write_file(os.path.join(root_dir, "old", "data.json"), b'{"id": "old"}')
+    write_file(os.path.join(root_dir, "old", "old_m.bin"), b"gzipped")
+    watcher = make_watcher(root_dir)
+
+    write_file(os.path.join(root_dir, "pack", "new song", "new song.tja"))
+    assert watcher.wait_for_changes()
+
+    # The sync's own changes come back as one batch, and the sync for that
+    # batch has nothing left to change, so things go quiet after it
+    fake_sync(root_dir)
+    assert watcher.wait_for_changes()
+    assert not watcher.backend.read(timeout=0.3)
+
+
+def test_changes_during_sync_are_kept(tmp_path, make_watcher):
+    root_dir = str(tmp_path / "customSongs")
+    os.makedirs(root_dir)
+    save_path = str(tmp_path / "save.json")
+    write_file(save_path, b"{}")
+    watcher = make_watcher(root_dir, [save_path])
+
+    # e.g. a song got copied in/played while the sync ran
+    fake_sync(root_dir)
+    new_song_dir = os.path.join(root_dir, "copied in")
+    write_file(os.path.join(new_song_dir, "data.json"), b'{"id": "copied"}')
+    write_file(save_path, b'{"m": {}}')
+    changes = watcher.wait_for_changes()
+    assert new_song_dir in changes
+    assert save_path in changes
@@ -0,0 +1,17 @@
+from metadata_table import MetadataTable
+
+SCHEMA = {'id': str, 'songName_text': str, 'starMax': int, 'shinuti': bool}
+
+
+def test_row_json_matches_to_jsons():
+    rows = [list(SCHEMA),
+            ["aaaa", "Song A", "8", "TRUE"],
+            ["bbbb", "Song B", "10", "FALSE"]]
+    table = MetadataTable.from_rows(rows, SCHEMA)
+    jsons = table.to_jsons()
+    for idx, song_id in enumerate(["aaaa", "bbbb"]):
+        json_dict = table.row_json(idx)
+        assert json_dict == jsons[song_id]
+        assert type(json_dict['starMax']) is int
+    assert table.row_json(1) == {'id': "bbbb", 'songName': {'text': "Song B"},
+                                 'starMax': 10, 'shinuti': False}
@@ -0,0 +1,59 @@
+import json
+import os
+
+import scan_manifest
+from scan_manifest import file_matches, read_datajson_record, scan_library
+
+
+def write_datajson(song_dir, song_id, mtime_ns):
+    json_path = os.path.join(song_dir, "data.json")
+    with open(json_path, "w", encoding="utf-8") as fp:
+        json.dump({'id': song_id}, fp)
+    os.utime(json_path, ns=(mtime_ns, mtime_ns))
+    return json_path
+
+
+def test_racy_record_gets_reread(tmp_path):
+    # A file rewritten (with the same size) within the same timestamp tick
+    # as the scan that recorded it looks untouched by size/mtime alone
+    song_dir = tmp_path / "song"
+    song_dir.mkdir()
+    mtime_ns = os.stat(tmp_path).st_mtime_ns
+    json_path = write_datajson(song_dir, "aaaa", mtime_ns)
+    record = read_datajson_record(song_dir)
+
+    write_datajson(song_dir, "bbbb", mtime_ns)
+    with open(json_path, "rb") as fp:
+        new_bytes = fp.read()
+    assert file_matches(json_path, new_bytes, record)
+    assert read_datajson_record(song_dir, record)['id'] == "bbbb"
+
+
+def test_old_record_is_trusted(tmp_path, monkeypatch):
+    song_dir = tmp_path / "song"
+    song_dir.mkdir()
+    old_mtime_ns = os.stat(tmp_path).st_mtime_ns - 10_000_000_000
+    write_datajson(song_dir, "aaaa", old_mtime_ns)
+    record = read_datajson_record(song_dir)
+    assert not scan_manifest.is_racy(record)
+
+    # Not re-read, so the (deliberately wrong) cached id sticks
+    record['id'] = "cached"
+    assert read_datajson_record(song_dir, record) is record
+
+
+def test_scan_rereads_racy_folders(tmp_path):
+    root_dir = tmp_path / "customSongs"
+    song_dir = root_dir / "song"
+    song_dir.mkdir(parents=True)
+    manifest_path = tmp_path / "manifest.json"
+    manifest = scan_library(root_dir, manifest_path)
+    assert manifest['dirs']['song']['datajson'] is None
+
+    # Restore the folder's mtime, as if data.json had been added within the
+    # same timestamp tick as the scan
+    dir_mtime_ns = os.stat(song_dir).st_mtime_ns
+    write_datajson(song_dir, "aaaa", dir_mtime_ns)
+    os.utime(song_dir, ns=(dir_mtime_ns, dir_mtime_ns))
+    manifest = scan_library(root_dir, manifest_path)
+    assert manifest['dirs']['song']['datajson']['id'] == "aaaa"
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+import random
+
+from bench_utils import load_manager
+from synthetic_library import datajson_dict, write_song
+
+
+def test_import_workers_start_with_spawn(tmp_path):
+    # Windows/macOS start workers with "spawn", where they have to import
+    # the worker functions by module name (which `data.json_manager`,
+    # loaded here the same way the benchmarks load it, doesn't have)
+    manager = load_manager()
+    rng = random.Random(0)
+    datajson_paths = {}
+    for song_id in ["spawn1", "spawn2"]:
+        song_dir = os.path.join(tmp_path, song_id)
+        write_song(song_dir, datajson_dict(song_id, rng), rng)
+        datajson_paths[song_id] = song_dir
+
+    results = manager.import_new_songs(
+        datajson_paths, datajson_paths, {}, manager.CSV_HEADERS,
+        max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+
+    assert [result.error for result in results] == [None, None]
+    for result in results:
+        assert result.song_json['scoreMania'] > 0
+        assert result.note_counts
@@ -0,0 +1,25 @@
+from song_order import ORDER_MODES, build_sort_keys
+
+
+def make_song(song_id, date, genre=0, star=5):
+    return {'id': song_id, 'songName': {'text': song_id}, 'date': date,
+            'genreNo': genre, 'starMax': star, 'starMania': star,
+            'starUra': 0, 'debut': ""}
+
+
+def test_unparseable_dates_sort_last():
+    jsons = {song['id']: song for song in [
+        make_song("blank", ""),
+        make_song("old", "2001-01-01"),
+        make_song("unknown", "????"),
+        make_song("new", "2020-05-05"),
+        make_song("played", ""),
+    ]}
+    entries = {"played": {'Score': "1000000"}}
+    keys = build_sort_keys(jsons, entries)
+    song_ids = list(jsons)
+    for mode in ["score", "date", "genre-star"]:
+        order = [song_ids[i] for i in ORDER_MODES[mode](keys)]
+        assert sorted(order) == sorted(song_ids)
+    order = [song_ids[i] for i in ORDER_MODES["score"](keys)]
+    assert order == ["played", "new", "old", "blank", "unknown"]
@@ -0,0 +1,102 @@
+"""
+Batch tier engine for `combinedTier`/`combinedTierUra`.
+
+Each tier source (e.g. the wikiwiki clear tiers or the Discord DFC tiers)
+maps its labels to a numeric rating. Labels get mapped to ratings once per
+distinct label, and the combined tiers for the whole library are then a
+weighted average over whichever sources rated each chart. To add a new
+source, add its label map to `TIER_SOURCES`, its columns to `TIER_COLUMNS`
+and a default weight to `DEFAULT_TIER_WEIGHTS`.
+"""
+
+import numpy as np
+
+wikiwiki_map = {
+    'Extremely Difficult': 20,
+    'Difficult': 16,
+    'Strong': 12,
+    'Moderate': 8,
+    'Weak': 3,
+    'Misrepresentation': 0,
+}
+
+discord_map = {
+    'SS': 20,
+    'S++': 19,
+    'S+': 18,
+    'S': 17,
+    'A+': 16,
+    'A': 13.5,
+    'B': 11,
+    'C': 8.5,
+    'D': 6,
+    'E': 3.5,
+    'F': 1,
+}
+
+TIER_SOURCES = {
+    'clear': wikiwiki_map,
+    'dfc': discord_map,
+}
+
+# Which metadata column each source reads for the oni/ura charts
+TIER_COLUMNS = {
+    'combinedTier': {'clear': 'clearTier', 'dfc': 'dfcTier'},
+    'combinedTierUra': {'clear': 'clearTierUra', 'dfc': 'dfcTierUra'},
+}
+
+DEFAULT_TIER_WEIGHTS = {
+    'clear': 0.5,
+    'dfc': 0.5,
+}
+
+# Every column `compute_tiers` reads from
+TIER_INPUT_COLUMNS = (['starMania', 'starUra'] + list(TIER_COLUMNS)
+                      + [column for source_columns in TIER_COLUMNS.values()
+                         for column in source_columns.values()])
+
+
+def tier_ratings(labels, tier_map):
+    # NaN marks labels that the source doesn't rate (e.g. blank cells)
+    unique_labels, inverse = np.unique(np.asarray(labels, dtype=str),
+                                       return_inverse=True)
+    ratings = np.array([tier_map.get(label, np.nan)
+                        for label in unique_labels.tolist()],
+                       dtype=np.float64)
+    return ratings[inverse.reshape(-1)]
+
+
+def combine_tiers(ratings, weights):
+    # Weighted average over the sources that rated each chart, with weights
+    # renormalised per chart, so that a single rating counts in full
+    total = np.zeros(len(next(iter(ratings.values()))))
+    weight_sum = np.zeros_like(total)
+    for source, source_ratings in ratings.items():
+        is_rated = ~np.isnan(source_ratings)
+        total += np.where(is_rated, weights[source] * source_ratings, 0.0)
+        weight_sum += np.where(is_rated, weights[source], 0.0)
+    return np.divide(total, weight_sum, out=np.zeros_like(total),
+                     where=weight_sum > 0)
+
+
+def compute_tiers(columns, weights=None):
+    if weights is None:
+        weights = DEFAULT_TIER_WEIGHTS
+    tiers = {}
+    for tier_column, source_columns in TIER_COLUMNS.items():
+        ratings = {source: tier_ratings(columns[column], TIER_SOURCES[source])
+                   for source, column in source_columns.items()}
+        tiers[tier_column] = combine_tiers(ratings, weights)
+
+    # Only 10-star charts get a combined tier; leave the rest as they were
+    is_oni_10 = np.asarray(columns['starMania']) == 10
+    is_ura_10 = np.asarray(columns['starUra']) == 10
+    combined_ura = np.where(is_ura_10, tiers['combinedTierUra'],
+                            np.asarray(columns['combinedTierUra'],
+                                       dtype=np.float64))
+    combined = np.where(is_oni_10, tiers['combinedTier'],
+                        np.asarray(columns['combinedTier'],
+                                   dtype=np.float64))
+    # Copy the ura rating into the oni rating if oni != 10
+    combined = np.where(is_ura_10 & ~is_oni_10, combined_ura, combined)
+    return combined, combined_ura
@@ -0,0 +1,101 @@
+"""
+Persistent index of TJA headers (title, plus course/level/balloons/wave for
+each course), for querying folders full of TJAs, e.g. CustomSongSources.
+
+The index lives in `cache/tja_index.json`, keyed by each TJA's absolute
+path. Updating it only has to `stat` every TJA: headers only get re-read
+for TJAs whose size/mtime changed since the last update. Queries then run
+against the index alone.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import __cache_dir__, load_json_cache, write_json_atomic
+from tjaconvert.header import read_tja_header
+
+TJA_INDEX_PATH = os.path.join(__cache_dir__, "tja_index.json")
+TJA_INDEX_VERSION = 1
+
+
+def load_tja_index(index_path=TJA_INDEX_PATH):
+    index = load_json_cache(index_path, TJA_INDEX_VERSION)
+    return {} if index is None else index['tjas']
+
+
+def save_tja_index(tjas, index_path=TJA_INDEX_PATH):
+    write_json_atomic(index_path, {'version': TJA_INDEX_VERSION,
+                                   'tjas': tjas}, ensure_ascii=False)
+
+
+def find_tjas(root_dir):
+    # {TJA path: (size, mtime)}
+    tja_stats = {}
+    for root, _, files in os.walk(os.path.abspath(root_dir)):
+        for file in files:
+            if not file.endswith(".tja"):
+                continue
+            tja_path = os.path.join(root, file)
+            try:
+                stat = os.stat(tja_path)
+            except OSError:
+                continue
+            tja_stats[tja_path] = (stat.st_size, stat.st_mtime_ns)
+    return tja_stats
+
+
+def is_under(path, root_dir):
+    return path.startswith(os.path.join(os.path.abspath(root_dir), ""))
+
+
+def update_tja_index(tjas, root_dirs, max_workers=None):
+    # Brings the entries under `root_dirs` up to date (in place), and
+    # returns the # of TJAs whose headers had to be read
+    tja_stats = {}
+    for root_dir in root_dirs:
+        tja_stats.update(find_tjas(root_dir))
+    for tja_path in [tja_path for tja_path in tjas
+                     if tja_path not in tja_stats
+                     and any(is_under(tja_path, root_dir)
+                             for root_dir in root_dirs)]:
+        del tjas[tja_path]
+    stale = [tja_path for tja_path, (size, mtime) in tja_stats.items()
+             if tja_path not in tjas or tjas[tja_path]['size'] != size
+             or tjas[tja_path]['mtime'] != mtime]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        headers = list(executor.map(read_header, stale))
+    for tja_path, header in zip(stale, headers):
+        size, mtime = tja_stats[tja_path]
+        tjas[tja_path] = {'size': size, 'mtime': mtime, 'header': header}
+    return len(stale)
+
+
+def read_header(tja_path):
+    try:
+        return read_tja_header(tja_path)
+    except OSError as e:  # e.g. deleted since it was found
+        print(f"- WARNING: Couldn't read {tja_path}: {e}")
+        return None
+
+
+def tja_index(root_dirs, index_path=TJA_INDEX_PATH, max_workers=None):
+    # Loads the index, updates it for `root_dirs` and saves it if needed
+    tjas = load_tja_index(index_path)
+    old_tjas = dict(tjas)
+    update_tja_index(tjas, root_dirs, max_workers)
+    if tjas != old_tjas:
+        save_tja_index(tjas, index_path)
+    return tjas
+
+
+def courses_with_level(tjas, level, root_dirs=None):
+    # Yields (TJA path, header, course) for every course rated `level`
+    for tja_path, entry in sorted(tjas.items()):
+        if entry['header'] is None:
+            continue
+        if root_dirs is not None and not any(is_under(tja_path, root_dir)
+                                             for root_dir in root_dirs):
+            continue
+        for course in entry['header']['courses']:
+            if course['level'] == level:
+                yield tja_path, entry['header'], course
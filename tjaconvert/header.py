@@ -0,0 +1,108 @@
+"""
+Streaming reader for the metadata in a TJA's headers.
+
+A TJA is a handful of header lines (`TITLE:`, `WAVE:`, ...) followed by
+one `COURSE:`/`LEVEL:`/`BALLOON:` block plus a `#START`...`#END` chart per
+difficulty. The charts make up nearly all of the file, so their lines only
+get checked for `#END`, and the file is read line by line rather than all
+at once. The encoding is sniffed once, from the first few KB: a BOM, else
+UTF-8 if the bytes decode as UTF-8, else Shift-JIS (as cp932, the Windows
+superset that TJAs are actually written in).
+"""
+
+import codecs
+import io
+
+SNIFF_SIZE = 64 * 1024
+
+# TJA course names/numbers -> the names used in TJA files' `COURSE:` lines
+COURSE_NAMES = {
+    "0": "Easy", "easy": "Easy",
+    "1": "Normal", "normal": "Normal",
+    "2": "Hard", "hard": "Hard",
+    "3": "Oni", "oni": "Oni",
+    "4": "Edit", "edit": "Edit", "ura": "Edit",
+}
+DEFAULT_COURSE = "Oni"
+
+
+def sniff_encoding(bytestring, final=True):
+    # `final=False` for a prefix of the file, which might end partway
+    # through a multibyte character
+    if bytestring.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if bytestring.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(bytestring, final)
+    except UnicodeDecodeError:
+        return "cp932"
+    return "utf-8"
+
+
+def parse_balloons(value):
+    return [int(hits) for hits in value.replace(" ", "").split(",")
+            if hits.isdigit()]
+
+
+def parse_level(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def read_tja_header(tja_path):
+    # Returns the TJA's title fields, plus one dict per course charted
+    with open(tja_path, "rb") as fp:
+        encoding = sniff_encoding(fp.read(SNIFF_SIZE), final=False)
+        fp.seek(0)
+        lines = io.TextIOWrapper(fp, encoding=encoding, errors="replace")
+        return parse_tja_lines(lines, encoding)
+
+
+def parse_tja_lines(lines, encoding=None):
+    header = {'title': "", 'titleja': "", 'subtitle': "", 'wave': "",
+              'encoding': encoding, 'courses': []}
+    # Header values carry over from one course to the next (except for the
+    # balloon hits, which belong to a single chart)
+    course, level, balloons = DEFAULT_COURSE, None, []
+    seen_courses = set()
+    in_chart = False
+    for line in lines:
+        line = line.strip()
+        if in_chart:
+            if line.upper().startswith("#END"):
+                in_chart = False
+            continue
+        if line.upper().startswith("#START"):
+            in_chart = True
+            # Double-play charts (`#START P1`/`#START P2`) share a course
+            if course not in seen_courses:
+                seen_courses.add(course)
+                header['courses'].append({'course': course, 'level': level,
+                                          'balloons': balloons,
+                                          'wave': header['wave']})
+            balloons = []
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        key, value = key.strip().upper(), value.strip()
+        # Titles can contain "//", but numbers can be followed by comments
+        number = value.split("//")[0].strip()
+        if key == "TITLE":
+            header['title'] = value
+        elif key == "TITLEJA":
+            header['titleja'] = value
+        elif key == "SUBTITLE":
+            header['subtitle'] = value
+        elif key == "WAVE":
+            header['wave'] = value
+        elif key == "COURSE":
+            course = COURSE_NAMES.get(number.lower(), number)
+        elif key == "LEVEL":
+            level = parse_level(number)
+        elif key == "BALLOON":
+            balloons = parse_balloons(number)
+    return header
@@ -1,7 +1,18 @@
 import shutil
 import subprocess
 import os
+import io
 import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from tjaconvert.header import sniff_encoding
+
+ConversionResult = namedtuple("ConversionResult",
+                              ["root_dir", "errno", "message", "gen_dir"])
+
+# Can be pointed at another executable (e.g. the fake one the benchmarks use)
+TJACONVERT = os.environ.get("TJACONVERT", "TJAConvert.exe")
 
 
 def fix_song_path(root_dir):
@@ -21,14 +32,11 @@ def fix_song_path(root_dir):
     # Change WAVE: field to refer to 'song.ogg'
     path_tja = os.path.join(root_dir, fname_tja)
     tja = []
-    encoding = "shift-jis"
-    try:
-        with open(path_tja, "r", encoding=encoding) as fp:
-            lines = fp.readlines()
-    except UnicodeDecodeError:
-        encoding = "utf-8"
-        with open(path_tja, "r", encoding=encoding) as fp:
-            lines = fp.readlines()
+    with open(path_tja, "rb") as fp:
+        bytestring = fp.read()
+    encoding = sniff_encoding(bytestring)
+    lines = io.TextIOWrapper(io.BytesIO(bytestring),
+                             encoding=encoding).readlines()
     for line in lines:
         if line.startswith("WAVE:"):
             tja.append(f"WAVE:song{ext_song}\n")
@@ -44,11 +52,11 @@ def fix_song_path(root_dir):
     test = None
 
 
-def convert_tja(root_dir):
-    print(f"\n- Converting {root_dir}...")
+def convert_tja(root_dir, timeout=None):
     fix_song_path(root_dir)
-    raw_output = subprocess.Popen(["TJAConvert.exe", root_dir],
-                                  stdout=subprocess.PIPE).communicate()[0]
+    raw_output = subprocess.run([TJACONVERT, root_dir],
+                                stdout=subprocess.PIPE,
+                                timeout=timeout).stdout
     raw_output = raw_output.split(b"\r\n")
     decoded_output = []
     for output in raw_output:
@@ -71,6 +79,26 @@ def convert_tja(root_dir):
     return int(err_str), msg, gen_dir
 
 
+def convert_tja_job(root_dir, timeout=None):
+    try:
+        return ConversionResult(root_dir, *convert_tja(root_dir, timeout))
+    except subprocess.TimeoutExpired:
+        return ConversionResult(root_dir, -1,
+                                f"Timed out after {timeout} seconds", None)
+    except Exception as e:  # noqa, one bad TJA shouldn't stop the batch
+        return ConversionResult(root_dir, -1, f"{type(e).__name__}: {e}",
+                                None)
+
+
+def convert_tjas(root_dirs, max_workers=None, timeout=None):
+    # Each job mostly waits on its own TJAConvert.exe process, so threads
+    # are enough to keep several conversions running at once
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda root_dir:
+                                 convert_tja_job(root_dir, timeout),
+                                 root_dirs))
+
+
 def generate_conversion_json(root_dir, gen_dir):
     json_dict = {
         "i": [{
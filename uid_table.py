@@ -0,0 +1,55 @@
+"""
+Song ID <-> TakoTako UID lookups.
+
+TakoTako keys its save.json scores by a murmurhash2-based UID rather than
+by song ID. Hashing is cheap enough (murmurhash2 runs in C) that UIDs are
+just recomputed for every song ID, rather than cached on disk:
+`benchmarks/bench_uid_table.py` found loading such a cache no faster than
+re-hashing 100k song IDs.
+
+Since UIDs are only 28 bits wide (and `uniqueId`s get copied around by
+hand), this module also finds songs that collide on either one.
+"""
+
+from utils import songid_to_uid
+
+
+def song_uids(song_ids):
+    return {song_id: songid_to_uid(song_id) for song_id in song_ids}
+
+
+def uid_index(song_ids):
+    # Reverse index (UID -> song ID) over just the given song IDs
+    return {uid: song_id for song_id, uid in song_uids(song_ids).items()}
+
+
+def remap_scores(score_dict, index):
+    # Join TakoTako's scores (keyed by UID) against the index in one pass,
+    # dropping scores for songs that aren't in the index
+    return {index[uid]: song_dict for uid, song_dict in score_dict.items()
+            if uid in index}
+
+
+def find_collisions(values):
+    # {song ID: value} -> {value: [song IDs]}, for values shared by 2+ songs
+    groups = {}
+    for song_id, value in values.items():
+        groups.setdefault(value, []).append(song_id)
+    return {value: sorted(song_ids) for value, song_ids in groups.items()
+            if len(song_ids) > 1}
+
+
+def reassign_unique_ids(unique_ids):
+    # For each colliding `uniqueId`, the song with the first song ID keeps
+    # it, and the others get fresh values above the largest one in use.
+    # Blank `uniqueId`s are left alone.
+    collisions = find_collisions({song_id: unique_id for song_id, unique_id
+                                  in unique_ids.items() if unique_id != ""})
+    next_unique_id = max((int(unique_id) for unique_id in unique_ids.values()
+                          if unique_id.isdigit()), default=0) + 1
+    reassigned = {}
+    for song_id in sorted(song_id for song_ids in collisions.values()
+                          for song_id in song_ids[1:]):
+        reassigned[song_id] = str(next_unique_id)
+        next_unique_id += 1
+    return collisions, reassigned
@@ -5,15 +5,21 @@ Interfacing with Google Sheets using Python.
 """
 
 # stdlib
+import argparse
+import os
 import sys
-
-# third party libraries
-import pygsheets
-import pandas
+from bisect import bisect_right
 
 # personal utility libraries
 from utils import (load_takotako_save_json_with_songids, load_data_jsons,
-                   GENRES, __custom_dir__)
+                   load_json_cache, write_json_atomic, GENRES, __custom_dir__,
+                   __cache_dir__)
+from gsheet_sync import sync_rows
+
+SHEET_NAME = 'Taiko no Tatsujin Score Tracker'
+# The entries from the last upload, in the order they're in on the sheet
+SNAPSHOT_PATH = os.path.join(__cache_dir__, "highscore_snapshot.json")
+SNAPSHOT_VERSION = 1
 
 
 def generate_highscore_spreadsheet(data_jsons, scores):
@@ -82,39 +88,122 @@ def generate_highscore_spreadsheet(data_jsons, scores):
     return entries
 
 
-def main():
+def order_func(item):
+    return [
+        (10 - int(item['*'])),
+        (1_000_000 - int(item['Score'] if item['Score'] else 0)),
+        (20 - float(item['*_'] if item['*_'] else 0)),
+        item['Genre'],
+    ]
+
+
+def entry_sort_key(entry):
+    # Ties are broken the same way a stable sort of `entries` breaks them
+    # (by song ID, with ura after omote), so that every key is unique and
+    # an entry's position can be found with a binary search
+    song_id = entry['SongID']
+    is_ura = song_id.endswith("_ura")
+    return order_func(entry) + [song_id[:-len("_ura")] if is_ura else song_id,
+                                is_ura]
+
+
+def load_snapshot(snapshot_path=SNAPSHOT_PATH):
+    snapshot = load_json_cache(snapshot_path, SNAPSHOT_VERSION)
+    return None if snapshot is None else snapshot['entries']
+
+
+def save_snapshot(sorted_entries, snapshot_path=SNAPSHOT_PATH):
+    write_json_atomic(snapshot_path, {'version': SNAPSHOT_VERSION,
+                                      'entries': sorted_entries},
+                      ensure_ascii=False)
+
+
+def entries_to_rows(sorted_entries):
+    if not sorted_entries:
+        return []
+    header = list(sorted_entries[0].keys())
+    return [header] + [[entry[key] for key in header]
+                       for entry in sorted_entries]
+
+
+def same_columns(old_entries, entries):
+    old_header = list(old_entries[0]) if old_entries else []
+    new_header = list(next(iter(entries.values()), {}))
+    return old_header == new_header
+
+
+def changed_song_ids(old_entries, entries):
+    # New songs, plus songs with a new best score, crown, combo, etc.
+    old_entries = {entry['SongID']: entry for entry in old_entries}
+    return {song_id for song_id, entry in entries.items()
+            if old_entries.get(song_id) != entry}
+
+
+def update_sorted_entries(old_entries, entries, changed):
+    # Unchanged entries keep their (already sorted) places, and only the
+    # changed ones get re-sorted back in
+    sorted_entries = [entry for entry in old_entries
+                      if entry['SongID'] in entries
+                      and entry['SongID'] not in changed]
+    keys = [entry_sort_key(entry) for entry in sorted_entries]
+    for song_id in changed:
+        key = entry_sort_key(entries[song_id])
+        idx = bisect_right(keys, key)
+        keys.insert(idx, key)
+        sorted_entries.insert(idx, entries[song_id])
+    return sorted_entries
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Upload TakoTako high scores to Google Sheets.")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-sort and re-upload the whole sheet, instead "
+                             "of only the songs that changed since the last "
+                             "upload (e.g. if the sheet was edited by hand)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # third party libraries (slow to import, so only needed when uploading)
+    import pygsheets
+
     # Load song data from files
     data_jsons = load_data_jsons(__custom_dir__)
     _, scores = load_takotako_save_json_with_songids(data_jsons.keys())
 
     # Convert song data into high score spreadsheet
     entries = generate_highscore_spreadsheet(data_jsons, scores)
-
-    def order_func(item):
-        return [
-            (10 - int(item['*'])),
-            (1_000_000 - int(item['Score'] if item['Score'] else 0)),
-            (20 - float(item['*_'] if item['*_'] else 0)),
-            item['Genre'],
-        ]
-
-    sorted_entries = sorted([j for j in entries.values()], key=order_func)
-    entries = {json_dict['SongID']: json_dict for json_dict in sorted_entries}
-
-    df = pandas.DataFrame.from_dict(entries)
-    df = df.transpose()
+    old_entries = None if args.full else load_snapshot()
+    if old_entries is not None and not same_columns(old_entries, entries):
+        old_entries = None  # The old rows are no use if the columns changed
 
     # Upload high score spreadsheet to Google Sheets
     gc = pygsheets.authorize(service_file='credentials.json')
-    sh = gc.open('Taiko no Tatsujin Score Tracker')
+    sh = gc.open(SHEET_NAME)
     wks = sh.sheet1
     print("Loaded sheet...")
-    wks.set_dataframe(df, (1, 1))
-    print("Uploaded sheet...")
+    n_cells = None
+    if old_entries is not None:
+        changed = changed_song_ids(old_entries, entries)
+        sorted_entries = update_sorted_entries(old_entries, entries, changed)
+        n_cells = sync_rows(wks, entries_to_rows(old_entries),
+                            entries_to_rows(sorted_entries))
+        if n_cells is not None:
+            print(f"Uploaded {n_cells} cells for {len(changed)} changed "
+                  f"songs...")
+    if n_cells is None:
+        # No snapshot to diff against, or too much changed for a diff
+        import pandas
+        sorted_entries = sorted(entries.values(), key=entry_sort_key)
+        df = pandas.DataFrame.from_dict({entry['SongID']: entry
+                                         for entry in sorted_entries})
+        df = df.transpose()
+        wks.set_dataframe(df, (1, 1))
+        print("Uploaded sheet...")
+    save_snapshot(sorted_entries)
 
 
 if __name__ == '__main__':
     sys.exit(main())
-
-
-
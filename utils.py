@@ -1,12 +1,26 @@
 import os
 import json
+import codecs
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 from murmurhash2 import murmurhash2
 
+# orjson is optional, but parses data.json files several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 __tdmx_dir__ = os.path.join("C:\\", "Users", "Joshua", "Saved Games", "TaikoTDM")
 __custom_dir__ = os.path.join(__tdmx_dir__, "customSongs")
 __takotako_save__ = os.path.join(__tdmx_dir__, "TakoTako", "saves",
                                  "save.json")
+# Persistent caches (scan manifest, etc.) live next to these scripts, unless
+# TDMX_CACHE_DIR says otherwise (e.g. so benchmarks don't touch the real ones)
+__cache_dir__ = os.environ.get(
+    "TDMX_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
 
 GENRES = {
     0: "Pops",
@@ -20,26 +34,115 @@ GENRES = {
 }
 
 
-def read_json(json_filepath):
-    for e_str in ["utf-8", "utf-8-sig"]:
+def parse_json_bytes(bytestring):
+    # Handles the BOM that our own data.json files are written with (and
+    # that `json`/orjson both reject) without decoding the file twice
+    if bytestring.startswith(codecs.BOM_UTF8):
+        bytestring = bytestring[len(codecs.BOM_UTF8):]
+    if orjson is not None:
         try:
-            with open(json_filepath, encoding=e_str) as fp:
-                return json.load(fp)
-        except json.decoder.JSONDecodeError:
-            pass
-
-
-def load_data_jsons(root_dir):
-    jsons = {}
-    for root, dirs, files in os.walk(root_dir, topdown=True):
-        if "data.json" not in files:
-            continue
-        json_path = os.path.join(root, "data.json")
-        json_dict = read_json(json_path)
-        jsons[json_dict['id']] = json_dict
+            return orjson.loads(bytestring)
+        except orjson.JSONDecodeError:
+            pass  # e.g. NaN, which only `json` accepts
+    return json.loads(bytestring.decode("utf-8"))
+
+
+def read_json(json_filepath):
+    with open(json_filepath, "rb") as fp:
+        bytestring = fp.read()
+    try:
+        return parse_json_bytes(bytestring)
+    except ValueError:  # Incl. `UnicodeDecodeError`s
+        return None
+
+
+def file_digest(filepath, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(filepath, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_bytes_atomic(filepath, bytestring):
+    # Write to a temp file in the same folder, then swap it into place, so
+    # that an interrupted run never leaves a half-written file behind
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "wb") as fp:
+        fp.write(bytestring)
+    os.replace(tmp_filepath, filepath)
+
+
+def write_json_atomic(json_filepath, obj, **dump_kwargs):
+    write_bytes_atomic(json_filepath,
+                       json.dumps(obj, **dump_kwargs).encode("utf-8"))
+
+
+def load_json_cache(json_filepath, version=None):
+    # Returns None if the cache is missing, unreadable or (for versioned
+    # caches, i.e. `{'version': N, ...}`) was written by another version
+    try:
+        with open(json_filepath, "rb") as fp:
+            cache = parse_json_bytes(fp.read())
+    except (OSError, ValueError):
+        return None
+    if version is not None and (not isinstance(cache, dict)
+                                or cache.get('version') != version):
+        return None
+    return cache
+
+
+def load_data_jsons(root_dir, max_workers=None, manifest=None):
+    # Imported here, since `scan_manifest` itself depends on this module
+    from scan_manifest import scan_library, iter_dirs
+    # `manifest` can be passed in by callers that already scanned `root_dir`
+    if manifest is None:
+        manifest = scan_library(root_dir)
+    return read_data_jsons([root for root, entry in iter_dirs(manifest)
+                            if entry['datajson'] is not None
+                            and entry['datajson']['id'] is not None],
+                           max_workers)
+
+
+def read_data_jsons(song_dirs, max_workers=None):
+    json_paths = [os.path.join(song_dir, "data.json")
+                  for song_dir in song_dirs]
+    # Opening each file is the slow part (especially on Windows), so several
+    # get read at once
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        json_dicts = list(executor.map(read_json, json_paths))
+    jsons = {json_dict['id']: json_dict for json_dict in json_dicts
+             if json_dict is not None}
     return {k: jsons[k] for k in sorted(jsons.keys())}
 
 
+def flatten_dict(nested_dict):
+    flattened_dict = {}
+    for outer_key, outer_val in nested_dict.items():
+        if isinstance(outer_val, dict):
+            for inner_key, inner_val in outer_val.items():
+                flattened_dict[f"{outer_key}_{inner_key}"] = inner_val
+        else:
+            flattened_dict[outer_key] = outer_val
+
+    return flattened_dict
+
+
+def unflatten_dict(flat_dict):
+    nested_dict = {}
+    for key, value in flat_dict.items():
+        subkeys = key.split("_")
+        if len(subkeys) == 1:
+            nested_dict[key] = value
+        else:
+            if subkeys[0] not in nested_dict.keys():
+                nested_dict[subkeys[0]] = {}
+            nested_dict[subkeys[0]][subkeys[1]] = value
+
+    return nested_dict
+
+
 def songid_to_uid(song_id):
     if str(song_id).isdigit():
         return str(song_id)
@@ -48,16 +151,16 @@ def songid_to_uid(song_id):
                    & 0xFFFF_FFF)
 
 
-def load_takotako_save_json_with_songids(song_ids):
+def load_takotako_save_json_with_songids(song_ids, save_path=None):
+    # Imported here, since `uid_table` itself depends on this module
+    from uid_table import uid_index, remap_scores
+    if save_path is None:
+        save_path = __takotako_save__
     # Read jsons from files
-    takotako_scores = read_json(__takotako_save__)
+    takotako_scores = read_json(save_path)
     # Covert TakoTako's UIDs into their corresponding song IDs
-    ids = {songid_to_uid(song_id): song_id for song_id in song_ids}
-    for score_key, score_dict in takotako_scores.items():
-        new_score_dict = {}
-        for unique_id, song_dict in score_dict.items():
-            if unique_id in ids.keys():
-                new_score_dict[ids[unique_id]] = song_dict
-        takotako_scores[score_key] = new_score_dict
+    index = uid_index(song_ids)
+    takotako_scores = {score_key: remap_scores(score_dict, index)
+                       for score_key, score_dict in takotako_scores.items()}
     # Split dict of dict into two dicts
     return takotako_scores['m'], takotako_scores['r']